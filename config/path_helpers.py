@@ -6,6 +6,9 @@ DATA_DB = DATA_LOCATION / 'db'
 OPTIX_DB_PATH = DATA_DB / 'perception.db'
 DATA_LOGS = DATA_LOCATION / 'logs'
 PROD_LOG_PATH = f"{DATA_LOGS}/prod.log"
+DATA_CACHE = DATA_LOCATION / 'cache'
+HARDWARE_INVENTORY_CACHE_PATH = DATA_CACHE / 'hardware_inventory.json'
+RUN_ARCHIVE_LOCATION = DATA_LOCATION / 'simulation_runs'
 
 PROD_OUTPUT = DATA_LOCATION / 'data' / 'production' / 'output'
 LEGACY_PROD_OUTPUT = DATA_LOCATION / 'production' / 'output'
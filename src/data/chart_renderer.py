@@ -0,0 +1,142 @@
+# coding: utf-8
+
+import io
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence
+
+import numpy as np
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+CHART_WIDTH_INCHES = 14.5
+CHART_HEIGHT_INCHES = 6
+CHART_DPI = 100
+# about two points per horizontal pixel of a chart, more cannot be told apart
+MAX_CHART_POINTS = int(CHART_WIDTH_INCHES * CHART_DPI * 2)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> (np.ndarray, np.ndarray):
+    """
+    Downsample a line to threshold points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept. Every bucket in between keeps the point that forms the largest
+    triangle with the point kept in the previous bucket and the mean of the next bucket, so peaks and dips
+    survive the downsampling unlike with a plain stride.
+    """
+    length = len(y)
+    if threshold >= length or threshold < 3:
+        return x, y
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bucket_edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    sampled = np.empty(threshold, dtype=np.int64)
+    sampled[0] = 0
+    sampled[-1] = length - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_end = bucket_edges[bucket + 2] if bucket + 2 < len(bucket_edges) else length
+        next_start = end if end < next_end else next_end - 1
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        # twice the area of the triangles (previous point, candidate, mean of the next bucket)
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        sampled[bucket + 1] = previous
+    return x[sampled], y[sampled]
+
+
+def downsample_columns(data: np.ndarray, max_columns: int) -> np.ndarray:
+    """:return: a (rows, max_columns) array of the means of equal buckets of the columns of data at most"""
+    columns = data.shape[1]
+    if columns <= max_columns:
+        return data
+    bucket_edges = np.linspace(0, columns, max_columns + 1).astype(np.int64)
+    return np.add.reduceat(data, bucket_edges[:-1], axis=1) / np.diff(bucket_edges)
+
+
+def figure_to_png(figure) -> bytes:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    buffer = io.BytesIO()
+    FigureCanvasAgg(figure)
+    figure.savefig(buffer, format="png", dpi=CHART_DPI, bbox_inches='tight', pad_inches=0.1)
+    return buffer.getvalue()
+
+
+def render_line_chart(data: np.ndarray, title: str, sample_time: np.ndarray = None,
+                      max_points: int = MAX_CHART_POINTS) -> bytes:
+    """
+    :param sample_time: wall clock time of every sample, the x axis shows the seconds since the first one
+    :return: the chart as PNG
+    """
+    # matplotlib takes a while to import, it is only needed once a report is rendered
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(CHART_WIDTH_INCHES, CHART_HEIGHT_INCHES))
+    axes = figure.add_subplot()
+    if sample_time is not None and len(sample_time):
+        x, y = lttb(sample_time - sample_time[0], data, max_points)
+        axes.set_xlabel("Time (s)")
+    else:
+        x, y = lttb(np.arange(len(data)), data, max_points)
+        axes.set_xlabel("Sample")
+    axes.plot(x, y)
+    axes.set_title(title)
+    axes.set_ylabel(title)
+    axes.grid(True)
+    return figure_to_png(figure)
+
+
+def render_heatmap(data: np.ndarray, title: str, sample_time: np.ndarray = None, row_labels: Sequence[str] = None,
+                   highlighted_rows: Sequence[int] = (), max_points: int = MAX_CHART_POINTS) -> bytes:
+    """
+    :param data: (samples, rows) array in %, e.g. the usage of every CPU core
+    :param row_labels: y axis label of every row
+    :param highlighted_rows: rows whose label is drawn in red
+    :return: the chart as PNG
+    """
+    from matplotlib.figure import Figure
+
+    row_count = data.shape[1]
+    figure = Figure(figsize=(CHART_WIDTH_INCHES, max(CHART_HEIGHT_INCHES, row_count * 0.3)))
+    axes = figure.add_subplot()
+    extent = None
+    if sample_time is not None and len(sample_time) > 1:
+        extent = (0, sample_time[-1] - sample_time[0], row_count - 0.5, -0.5)
+        axes.set_xlabel("Time (s)")
+    else:
+        axes.set_xlabel("Sample")
+    image = axes.imshow(downsample_columns(data.T, max_points), aspect='auto', interpolation='nearest', cmap='hot',
+                        vmin=0, vmax=100, extent=extent)
+    figure.colorbar(image, ax=axes, label="Usage (%)")
+    axes.set_yticks(range(row_count))
+    axes.set_yticklabels(row_labels or [str(row) for row in range(row_count)])
+    for row, label in enumerate(axes.get_yticklabels()):
+        if row in highlighted_rows:
+            label.set_color('red')
+            label.set_fontweight('bold')
+    axes.set_title(title)
+    return figure_to_png(figure)
+
+
+def render_chart(job: tuple) -> bytes:
+    """:param job: (render function, keyword arguments)"""
+    render, kwargs = job
+    return render(**kwargs)
+
+
+def render_charts(jobs: Sequence[tuple], max_workers: int = None) -> list:
+    """
+    Render charts in parallel, every chart in its own figure so no pyplot state is shared.
+    :param jobs: [(render_line_chart or render_heatmap, keyword arguments), ...]
+    :param max_workers: processes rendering the charts, 1 renders them in the current process
+    :return: the PNG of every chart, in the order of jobs
+    """
+    if max_workers == 1 or len(jobs) <= 1:
+        return [render_chart(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(render_chart, jobs))
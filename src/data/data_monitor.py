@@ -4,22 +4,28 @@ import os
 import re
 import time
 import psutil
-import matplotlib.pyplot as plt
+import numpy as np
 from datetime import datetime
 import platform
-import cpuinfo
-import GPUtil
 import subprocess
 from threading import Thread
-import inspect
-from openpyxl import Workbook, load_workbook
-from openpyxl.drawing.image import Image
-from openpyxl.utils import get_column_letter
-from pynvml import (nvmlInit, nvmlDeviceGetHandleByIndex, nvmlDeviceGetUtilizationRates,
-                    nvmlDeviceGetMemoryInfo, nvmlShutdown)
+from typing import Iterable, Iterator
 
 from log import formatted_logging
-from config.path_helpers import PROD_LOG_PATH
+from config.path_helpers import PROD_LOG_PATH, PROD_OUTPUT, HARDWARE_INVENTORY_CACHE_PATH, RUN_ARCHIVE_LOCATION
+from src.data.log_reader import iter_logs_between_start_end, find_window_offset
+from src.data.time_series import TimeSeriesStore
+from src.data.gpu_provider import GpuProvider, create_gpu_provider
+from src.data.process_sampler import ProcessSampler
+from src.data.system_sampler import SystemSampler
+from src.data.sampler_agent import SamplerAgent
+from src.data.hardware_inventory import HardwareInventory
+from src.data.report_store import ReportStore
+from src.data.run_archive import RunArchive
+from src.data.chart_renderer import render_line_chart, render_heatmap, render_charts, lttb
+from src.data.log_analyzer import (PartTimeMetric, CortexInferTimeMetric, ImageCaptureTimeMetric,
+                                   Generate25DTimeMetric, LogFollower, analyze_metric,
+                                   analyze_log_segments)
 
 if platform.system() == 'Windows':
     import wmi
@@ -35,76 +41,147 @@ logger = formatted_logging.FormattedLogging(__name__).getLog()
 
 class DataMonitor(object):
     REPORT_FILE_NAME = "simulation_results.xlsx"
-    GENERATE_25D_PATTERN = r"generate_overlaid_image_25d took ([\d.]+) seconds"
-
-    def __init__(self, data_monitor_config):
+    # rows and charts of every run, REPORT_FILE_NAME is generated from it
+    REPORT_STORE_DIRECTORY = "simulation_results"
+    GENERATE_25D_PATTERN = Generate25DTimeMetric.GENERATE_25D_PATTERN.pattern
+    REPORT_HEADER = [
+        # System Info
+        "Edge Name", "Camera Resolution", "Model Resize", "Network Architecture", "Software Version",
+        "NG Type Number", 'Each NG Type Defect Number', "Is Image Saving",
+
+        # Benchmark Data
+        "Part Count", "Total Use Time(s)", "FPS", "MP/s", "Max Part Use Time (s)", "Min Part Use Time (s)",
+        "Avg Part Use Time (s)", "Max Cortex Infer Time (ms)", "Min Cortex Infer Time (ms)",
+        "Avg Cortex Infer Time (ms)",
+
+        # System Data
+        "CPU", "GPU", "RAM", "SSD", "CPU Usage AVG (%)", "GPU Usage AVG (%)", "GPU Memory Usage AVG (%)",
+        "Memory Usage AVG (%)", "Disk Usage AVG (%)", "Disk Read Speed AVG (MB/s)",
+        "Disk Write Speed AVG (MB/s)",
+
+        # Core Allocation
+        "Core Allocation", "Created At",
+
+        # Tail Latency, appended last so that the columns of existing reports do not move
+        "P50 Part Use Time (s)", "P95 Part Use Time (s)", "P99 Part Use Time (s)",
+        "P50 Cortex Infer Time (ms)", "P95 Cortex Infer Time (ms)", "P99 Cortex Infer Time (ms)",
+
+        # Part Timeline
+        "Incomplete Part Count", "Bottleneck Stage",
+
+        # Per GPU and per process GPU Data
+        "GPUs Usage AVG (%)", "GPUs Memory Usage AVG (%)", "Cortex GPU Memory AVG (MB)", "Optix GPU Memory AVG (MB)",
+
+        # Per Process Data, CPU normalized to the affinity mask of the process
+        "Process Usage AVG",
+
+        # Per Core Data
+        "Saturated Cores",
+
+        # Cost of the monitoring itself
+        "Monitor Overhead AVG",
+
+        # Per Disk and per Network Interface Data
+        "Disk IO AVG", "Network IO AVG",
+    ]
+    # columns of self.system_data in the report, gpu_usage and gpu_mem_usage are averaged over all GPUs
+    SYSTEM_DATA_COLUMNS = SystemSampler.SYSTEM_DATA_COLUMNS
+    PROD_PROCESSES = {
+        "prod service": "production_src/server/run_prod.py",
+        "prod ui": "production_src/ui/run_prod.py",
+        "cortex": "production_src/server/run_prod_cortex.py",
+        "optix": "production_src/server/run_prod_optix.py"
+    }
+    # processes whose GPU memory is sampled, in MB
+    GPU_PROCESSES = ("cortex", "optix")
+    # (system data column, chart title, top left cell of the chart)
+    SYSTEM_DATA_CHARTS = (
+        ("cpu_usage", "CPU Usage (%)", "A1"),
+        ("gpu_usage", "GPU Usage (%)", "R1"),
+        ("gpu_mem_usage", "GPU Memory Usage (%)", "AI1"),
+        ("memory_usage", "Memory Usage (%)", "A36"),
+        ("disk_usage", "Disk Usage (%)", "R36"),
+        ("disk_read_speed", "Disk Read Speed (MB/s)", "AI36"),
+        ("disk_write_speed", "Disk Write Speed (MB/s)", "AZ36"),
+    )
+    CPU_CORES_HEATMAP_CELL = "A71"
+    # samples of every native chart of the report, can be overridden by the "report_max_samples" config key
+    REPORT_MAX_SAMPLES = 2000
+    # a core is saturated when its usage is at least SATURATED_CORE_USAGE % in SATURATED_CORE_RATIO of the samples,
+    # both can be overridden by the "saturated_core_usage" and "saturated_core_ratio" config keys
+    SATURATED_CORE_USAGE = 90.0
+    SATURATED_CORE_RATIO = 0.8
+
+    def __init__(self, data_monitor_config, gpu_provider: GpuProvider = None):
+        """
+        :param data_monitor_config: besides the benchmark settings, the optional keys
+                                    "export_report": generate REPORT_FILE_NAME after every run, off by default
+                                    as it rewrites all the runs, call export_report when the workbook is needed,
+                                    "report_chart_images": draw the system data charts as images instead of
+                                    native Excel charts,
+                                    "report_max_samples": samples kept for every native chart,
+                                    "run_archive": archive the samples and log events of every run (default),
+                                    "run_archive_compressed": compress the archive (default) or memory-map it,
+                                    "sampler_agent": sample in a separate process (default) or in a thread,
+                                    "sampler_agent_cores": CPU cores the sampler agent is pinned to,
+                                    "system_data_capacity": number of samples kept, all of them by default
+        :param gpu_provider: source of the GPU data, NVML by default or a NullGpuProvider on machines without
+                             NVIDIA GPU; a FakeGpuProvider allows testing the GPU data without one
+        """
         self.data_monitor_config = data_monitor_config
+        self.gpu_provider = gpu_provider or create_gpu_provider()
 
-        self.wb = None
+        self.report_store = None
         self.thread = None
+        self.sampler_agent = None
+        self.log_follower = None
         self.log_start_time = None
+        self.latency_percentiles = {}
+        self.log_events = {}
+        self.run_archive_path = None
         self.stop_system_data_flag = False
-        self.cpu_usage = []
-        self.gpu_usage = []
-        self.gpu_mem_usage = []
-        self.memory_usage = []
-        self.disk_usage = []
-        self.disk_read_speed = []
-        self.disk_write_speed = []
-        self.all_params = []
-
-        nvmlInit()
-        self.handle = nvmlDeviceGetHandleByIndex(0)
-
-        pass
+        self.sample_interval = 0.5
+        self.missed_ticks = 0
+        self.system_sampler = SystemSampler(self.gpu_provider, self.PROD_PROCESSES, self.GPU_PROCESSES,
+                                            output_path=PROD_OUTPUT)
+        self.gpu_count = self.system_sampler.gpu_count
+        self.core_count = self.system_sampler.core_count
+        self.process_sampler = self.system_sampler.process_sampler
+        self.system_data = TimeSeriesStore(self.get_system_data_columns(),
+                                           capacity=data_monitor_config.get("system_data_capacity"))
+        self.hardware_inventory = HardwareInventory({
+            "cpu": self.get_cpu_info,
+            "gpus": self.get_gpu_list,
+            "ram": self.get_memory_info,
+            "ssds": self.get_disk_list,
+        }, HARDWARE_INVENTORY_CACHE_PATH, modules=("cpuinfo", "GPUtil"))
+        # collected in the background without a valid cache, create_report waits for the result
+        self.hardware_inventory.refresh_in_background()
 
     def __del__(self):
-        nvmlShutdown()
+        self.gpu_provider.shutdown()
 
     @staticmethod
-    def grep_logs_between_start_end(log_file: str, start_pattern: str, end_pattern: str) -> list:
-        grep_times = 3
-        try:
-            for _ in range(grep_times):
-                cmd = f"sed -n '/{start_pattern}/,/{end_pattern}/p' {log_file}"
-                result = subprocess.run(
-                    cmd,
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    check=True
-                )
-                logs_between_start_end = result.stdout
-                if logs_between_start_end:
-                    return logs_between_start_end.split('\n')
-                else:
-                    start_pattern = datetime.strptime(start_pattern, '%Y-%m-%d %H:%M:%S').timestamp() + 1
-                    start_pattern = datetime.fromtimestamp(start_pattern).strftime('%Y-%m-%d %H:%M:%S')
-                    continue
-            return []
-        except Exception as e:
-            logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
-            return []
+    def grep_logs_between_start_end(log_file: str, start_pattern: str, end_pattern: str) -> Iterator[str]:
+        """
+        Stream the log lines logged between start_pattern and end_pattern ('%Y-%m-%d %H:%M:%S').
+        The window is read lazily, so every consumer has to call this again instead of re-iterating the result.
+        The start of the window is found through the sidecar offset index of the log instead of a scan from byte 0.
+        """
+        start_offset = find_window_offset(log_file, start_pattern)
+        return iter_logs_between_start_end(log_file, start_pattern, end_pattern, start_offset=start_offset)
 
     @staticmethod
-    def calculate_cortex_infer_time(result_log) -> list:
+    def calculate_cortex_infer_time(result_log: Iterable[str]) -> list:
         """
         获取Cortex推理每张图片的耗时，然后统计平均耗时，并获取最大耗时
         :param result_log:
-        :return:
+        :return: [max_infer_time, min_infer_time, average_infer_time]
         """
-        all_infer_time = []
-        for line in result_log:
-            if 'cortex batch inference on' in line:
-                all_infer_time.append(int(line.split(' ')[-1]))
-
-        if not all_infer_time:
-            return [0, 0, 0]
-        return [max(all_infer_time), min(all_infer_time), sum(all_infer_time) / len(all_infer_time)]
+        return analyze_metric(CortexInferTimeMetric(), result_log)
 
     @staticmethod
-    def get_generate_25d_time_cost(result_log):
+    def get_generate_25d_time_cost(result_log: Iterable[str]):
         """
         This function is used to get the generate_overlaid_image_25d time cost from log file
         :param result_log:
@@ -112,38 +189,16 @@ class DataMonitor(object):
                         "mean": [max_mean_time, min_mean_time, average_mean_time],
                         "height": [max_height_time, min_height_time, average_height_time]}
         """
-        all_normal_time = []
-        all_mean_time = []
-        all_height_time = []
-
-        for line in result_log:
-            if 'generate_overlaid_image_25d took' in line:
-                matches = re.findall(DataMonitor.GENERATE_25D_PATTERN, line)
-                if not matches:
-                    logger.error(f"{DataMonitor.GENERATE_25D_PATTERN} not in line {line}")
-                    continue
-
-                if "capture_config: NORMAL" in line:
-                    all_normal_time.append(matches[0])
-                elif "capture_config: MEAN" in line:
-                    all_mean_time.append(matches[0])
-                elif "capture_config: HEIGHT" in line:
-                    all_height_time.append(matches[0])
-
-        if not all_normal_time:
-            return_normal_time = [0, 0, 0]
-        else:
-            return_normal_time = [max(all_normal_time), min(all_normal_time), sum(all_normal_time) / len(all_normal_time)]
-        if not all_mean_time:
-            return_mean_time = [0, 0, 0]
-        else:
-            return_mean_time = [max(all_mean_time), min(all_mean_time), sum(all_mean_time) / len(all_mean_time)]
-        if not all_height_time:
-            return_height_time = [0, 0, 0]
-        else:
-            return_height_time = [max(all_height_time), min(all_height_time), sum(all_height_time) / len(all_height_time)]
+        return analyze_metric(Generate25DTimeMetric(), result_log)
 
-        return {"normal": return_normal_time, "mean": return_mean_time, "height": return_height_time}
+    @staticmethod
+    def get_image_capture_time_cost(result_log: Iterable[str]) -> list:
+        """
+        获取Optix获取每张图片的耗时，然后统计平均耗时，并获取最大耗时
+        :param result_log:
+        :return: [max_capture_time, min_capture_time, average_capture_time]
+        """
+        return analyze_metric(ImageCaptureTimeMetric(), result_log)
 
     @staticmethod
     def get_int_software_version() -> int:
@@ -169,13 +224,21 @@ class DataMonitor(object):
 
     @staticmethod
     def get_cpu_info() -> str:
+        import cpuinfo
+
         cpu_info = cpuinfo.get_cpu_info()
         return f"{cpu_info['brand_raw']}"
 
     @staticmethod
-    def get_gpu_info() -> str:
+    def get_gpu_list() -> list:
+        import GPUtil
+
         gpus = GPUtil.getGPUs()
-        return str([f"GPU: {gpu.name} {gpu.memoryTotal}MB" for gpu in gpus])
+        return [f"GPU: {gpu.name} {gpu.memoryTotal}MB" for gpu in gpus]
+
+    @staticmethod
+    def get_gpu_info() -> str:
+        return str(DataMonitor.get_gpu_list())
 
     @staticmethod
     def get_memory_info() -> str:
@@ -235,13 +298,14 @@ class DataMonitor(object):
                 return "Information not available"
 
     @staticmethod
-    def get_disk_info() -> str:
+    def get_disk_list():
+        """:return: the model and size of every disk, None when they cannot be listed"""
         if platform.system() == 'Windows':
             c = wmi.WMI()
             disks = []
             for disk in c.Win32_DiskDrive():
                 disks.append(f"{disk.Model} ({int(disk.Size) / (1024 ** 3):.2f}GB)")
-            return str(disks)
+            return disks
         else:
             try:
                 result = subprocess.run(['lsblk', '-o', 'NAME,MODEL,SIZE'], capture_output=True, text=True, check=True)
@@ -252,35 +316,31 @@ class DataMonitor(object):
                     if 'sd' in disk or 'nvme' in disk:
                         if '─' not in disk:
                             disk_info.append(f"{disk.split('    ')[1]}")
-                return str(disk_info)
+                return disk_info
             except FileNotFoundError:
-                return "Disk info requires 'lsblk'"
+                return None
 
     @staticmethod
-    def get_system_info() -> list:
-        info = [
-            DataMonitor.get_cpu_info(),
-            DataMonitor.get_gpu_info(),
-            DataMonitor.get_memory_info(),
-            DataMonitor.get_disk_info()
+    def get_disk_info() -> str:
+        disks = DataMonitor.get_disk_list()
+        return str(disks) if disks is not None else "Disk info requires 'lsblk'"
+
+    def get_system_info(self) -> list:
+        """:return: [CPU, GPUs, RAM, SSDs] of the report, from the cached hardware inventory or its collection"""
+        inventory = self.hardware_inventory.get()
+        ssds = inventory["ssds"]
+        return [
+            inventory["cpu"],
+            str(inventory["gpus"]),
+            inventory["ram"],
+            str(ssds) if ssds is not None else "Disk info requires 'lsblk'"
         ]
-        return info
 
-    @staticmethod
-    def plot_and_insert(data, title, cell, ws, data_list):
-        safe_title = re.sub(r'[\\/*?:"<>|]', "", title)
-        plt.figure(figsize=(14.5, 6))
-        plt.plot(data)
-        plt.title(title)
-        plt.xlabel("Time (500ms)")
-        plt.ylabel(title)
-        plt.grid(True)
-        plt.savefig(f"{safe_title}.png", dpi=100, bbox_inches='tight', pad_inches=0.1)
-        plt.close()
-
-        img = Image(f"{safe_title}.png")
-        ws.add_image(img, cell)
-        data_list.append(f"{safe_title}.png")
+    def get_ipc_config_data(self) -> dict:
+        """:return: the hardware inventory under the IPCConfig column names"""
+        with open(PRODUCTION_SOFTWARE_VERSION_TXT_PATH, 'r') as f:
+            software_version = f.readlines()[0].strip()
+        return self.hardware_inventory.to_ipc_config(self.data_monitor_config["edge_name"], software_version)
 
     @staticmethod
     def get_process_affinity(process_cmdline_part):
@@ -292,107 +352,220 @@ class DataMonitor(object):
                 pass
         return []
 
-    def calculate_part_time(self, result_log) -> list:
-        def get_part_group_id():
-            _temp_line_0 = line.split("'group_id': '")[-1]
-            return _temp_line_0.split("'")[0]
+    def get_cpu_core_columns(self) -> list:
+        return self.system_sampler.cpu_core_columns()
 
-        start_part_time = {}
-        end_part_time = {}
-        all_part_time = []
-        for line in result_log:
-            if 'Starting part group with parts' in line:
-                start_part_time[get_part_group_id()] = self.get_timestamp_from_log(line)
+    def get_system_data_columns(self) -> list:
+        return self.system_sampler.columns()
 
-            if 'Marking part group as done' in line:
-                end_part_time[get_part_group_id()] = self.get_timestamp_from_log(line)
+    def calculate_part_time(self, result_log: Iterable[str]) -> list:
+        return analyze_metric(PartTimeMetric(), result_log)
 
-        for key in start_part_time:
-            try:
-                all_part_time.append(end_part_time[key] - start_part_time[key])
-            except KeyError:
-                pass
-        if not all_part_time:
-            return [0, 0, 0]
-        logger.info(
-            f"all_part_num {len(all_part_time)}, result {[max(all_part_time), min(all_part_time), sum(all_part_time) / len(all_part_time)]}"
-        )
-        return [max(all_part_time), min(all_part_time), sum(all_part_time) / len(all_part_time)]
+    def analyze_logs(self, end_time: str) -> dict:
+        """
+        Compute every report metric in one pass over the log window of the benchmark.
+        When prod.log was followed during the run, this only reads what was logged after the last poll.
+        The tail latencies are kept in self.latency_percentiles, see LogAnalyzer.latency_percentiles.
+        :return: {metric name: metric result}, see create_default_analyzer
+        """
+        if self.log_follower is not None:
+            results = self.log_follower.stop(end_time)
+            analyzer = self.log_follower.analyzer
+        else:
+            # long runs span several rotated, possibly compressed, segments of prod.log
+            analyzer = analyze_log_segments(PROD_LOG_PATH, self.log_start_time, end_time)
+            results = analyzer.results()
+        self.latency_percentiles = analyzer.latency_percentiles()
+        self.log_events = analyzer.events()
+        logger.info(f"all_part_num {analyzer.metrics['part_time'].stats.count}, result {results['part_time']}")
+        part_timeline = results["part_timeline"]
+        logger.info(f"parts {part_timeline['parts']}, incomplete parts {part_timeline['incomplete_parts']}, "
+                    f"bottleneck stage {self.get_bottleneck_summary(part_timeline)}, stages {part_timeline['stages']}")
+        return results
 
     def clear_system_data(self):
         self.stop_system_data_flag = False
-        self.cpu_usage = []
-        self.gpu_usage = []
-        self.gpu_mem_usage = []
-        self.memory_usage = []
-        self.disk_usage = []
-        self.disk_read_speed = []
-        self.disk_write_speed = []
+        self.missed_ticks = 0
+        self.system_data.clear()
 
     def create_workbook(self):
-        try:
-            self.wb = load_workbook(self.REPORT_FILE_NAME)
-        except FileNotFoundError:
-            self.wb = Workbook()
+        self.report_store = ReportStore(self.REPORT_STORE_DIRECTORY)
+        if self.report_store.is_empty() and os.path.exists(self.REPORT_FILE_NAME):
+            # reports written before the store existed are imported once
+            self.report_store.import_xlsx(self.REPORT_FILE_NAME)
 
-    def get_system_data(self, start_time: float):
+    def export_report(self):
+        """Generate REPORT_FILE_NAME from the report store."""
+        self.report_store.write_xlsx(self.REPORT_FILE_NAME)
+
+    def get_system_data(self, start_time: float, follow_log: bool = True, sample_interval: float = 0.5):
+        """
+        Start sampling the system data from start_time on.
+        :param follow_log: also tail prod.log during the run, see get_live_log_metrics
+        :param sample_interval: sampling period in seconds, intervals well below 100ms are supported
+        :raise RuntimeError: the sampler agent did not start, see SamplerAgent
+        """
         self.log_start_time = datetime.fromtimestamp(start_time).strftime('%Y-%m-%d %H:%M:%S')
-        self.thread = Thread(target=self.thread_get_system_data, daemon=True)
+        self.log_follower = None
+        if follow_log:
+            self.log_follower = LogFollower(PROD_LOG_PATH, self.log_start_time)
+            self.log_follower.start()
+        if self.data_monitor_config.get("sampler_agent", True):
+            self.clear_system_data()
+            self.sample_interval = sample_interval
+            self.sampler_agent = SamplerAgent(self.system_sampler, sample_interval, self.system_data.append,
+                                              cores=self.data_monitor_config.get("sampler_agent_cores"))
+            return self.sampler_agent.start()
+        self.sampler_agent = None
+        self.thread = Thread(target=self.thread_get_system_data, args=(sample_interval,), daemon=True)
         self.thread.start()
         return self.thread
 
     def stop_system_data(self):
-        self.stop_system_data_flag = True
-        self.thread.join()
+        if self.sampler_agent is not None:
+            self.missed_ticks = self.sampler_agent.stop()
+            self.log_missed_ticks()
+        else:
+            self.stop_system_data_flag = True
+            self.thread.join()
+        if self.log_follower is not None:
+            self.log_follower.stop_follow_flag = True
+
+    def get_live_log_metrics(self) -> dict:
+        """:return: the log metrics of the running benchmark so far, {} when prod.log is not followed"""
+        if self.log_follower is None:
+            return {}
+        return self.log_follower.results()
 
     def thread_get_system_data(self, interval: float = 0.5):
-        last_disk_io = psutil.disk_io_counters()
-        last_time = time.time()
+        """
+        Sample the system data every interval seconds until stop_system_data, in the process of the controller.
+        See SystemSampler.sample_until, the ticks that were skipped are counted in self.missed_ticks.
+        """
         self.clear_system_data()
+        self.sample_interval = interval
+        self.missed_ticks = self.system_sampler.sample_until(interval, self.system_data.append,
+                                                             lambda: self.stop_system_data_flag)
+        self.log_missed_ticks()
 
-        while not self.stop_system_data_flag:
-            self.cpu_usage.append(psutil.cpu_percent(interval=0))
-
-            gpu_util = nvmlDeviceGetUtilizationRates(self.handle)
-            self.gpu_usage.append(gpu_util.gpu)
-            gpu_mem = nvmlDeviceGetMemoryInfo(self.handle)
-            self.gpu_mem_usage.append((gpu_mem.used / gpu_mem.total) * 100)
-
-            memory_info = psutil.virtual_memory()
-            self.memory_usage.append(memory_info.percent)
-
-            disk_info = psutil.disk_usage('/')
-            self.disk_usage.append(disk_info.percent)
-
-            current_disk_io = psutil.disk_io_counters()
-            current_time = time.time()
-            read_speed = (current_disk_io.read_bytes - last_disk_io.read_bytes) / (current_time - last_time) / (
-                    1024 * 1024)
-            write_speed = (current_disk_io.write_bytes - last_disk_io.write_bytes) / (current_time - last_time) / (
-                    1024 * 1024)
-            self.disk_read_speed.append(read_speed)
-            self.disk_write_speed.append(write_speed)
-            last_disk_io = current_disk_io
-            last_time = current_time
-
-            time.sleep(interval)
+    def log_missed_ticks(self):
+        if self.missed_ticks:
+            logger.warning(f"System data sampling missed {self.missed_ticks} ticks of {self.sample_interval}s, "
+                           f"{self.system_data.total_count} samples taken.")
 
     def get_core_allocation(self) -> str:
-        processes = {
-            "prod service": "production_src/server/run_prod.py",
-            "prod ui": "production_src/ui/run_prod.py",
-            "cortex": "production_src/server/run_prod_cortex.py",
-            "optix": "production_src/server/run_prod_optix.py"
-        }
         core_allocation = ''
-        for name, cmdline_part in processes.items():
-            affinity = self.get_process_affinity(cmdline_part)
+        for name in self.PROD_PROCESSES:
+            affinity = self.process_sampler.affinity(name)
             if affinity:
                 core_allocation += f"{name}: {', '.join(map(str, affinity))}\n"
             else:
                 core_allocation += f"{name}: Process not found\n"
         return core_allocation
 
+    def get_core_owners(self) -> dict:
+        """:return: {core: [names of the production processes allowed to run on it]}"""
+        core_owners = {}
+        for name in self.PROD_PROCESSES:
+            for core in self.process_sampler.affinity(name):
+                core_owners.setdefault(core, []).append(name)
+        return core_owners
+
+    def get_saturated_cores(self) -> list:
+        """:return: the cores that were saturated during the benchmark, see SATURATED_CORE_USAGE"""
+        cpu_cores_usage = self.system_data.matrix(self.get_cpu_core_columns())
+        if not len(cpu_cores_usage):
+            return []
+        saturated_usage = self.data_monitor_config.get("saturated_core_usage", self.SATURATED_CORE_USAGE)
+        saturated_ratio = self.data_monitor_config.get("saturated_core_ratio", self.SATURATED_CORE_RATIO)
+        saturated_samples = (cpu_cores_usage >= saturated_usage).mean(axis=0)
+        return [int(core) for core in np.flatnonzero(saturated_samples >= saturated_ratio)]
+
+    def get_saturated_core_summary(self, saturated_cores: list, core_owners: dict) -> str:
+        if not saturated_cores:
+            return "None"
+        saturated_core_summary = ''
+        for core in saturated_cores:
+            owners = ', '.join(core_owners.get(core, [])) or "no production process"
+            saturated_core_summary += (f"core {core} ({owners}): "
+                                       f"{self.system_data.mean(f'cpu{core}_usage'):.1f}% AVG\n")
+        return saturated_core_summary
+
+    @staticmethod
+    def get_bottleneck_summary(part_timeline: dict) -> str:
+        """:return: the bottleneck stage of the part timeline, or None and the stage events without a group id"""
+        if part_timeline["bottleneck"] is not None:
+            return part_timeline["bottleneck"]
+        unattributed_events = ', '.join(f"{stage} {count}" for stage, count in
+                                        part_timeline["unattributed_events"].items() if count)
+        return f"None (unattributed events: {unattributed_events})" if unattributed_events else "None"
+
+    def get_process_usage(self) -> str:
+        """:return: the average resource usage of every production process, one line per process"""
+        process_usage = ''
+        for name in self.PROD_PROCESSES:
+            prefix = ProcessSampler.column_prefix(name)
+            averages = {metric: self.system_data.mean(f"{prefix}_{metric}") for metric in ProcessSampler.METRICS}
+            process_usage += (f"{name}: CPU {averages['cpu_percent']:.1f}%, RSS {averages['rss_mb']:.0f}MB, "
+                              f"threads {averages['num_threads']:.0f}, ctx switches {averages['ctx_switches']:.0f}/s, "
+                              f"IO read {averages['io_read_speed']:.2f}MB/s write {averages['io_write_speed']:.2f}MB/s\n")
+        return process_usage
+
+    def get_monitor_overhead(self) -> str:
+        """:return: the average CPU and memory usage of the process that sampled the system data"""
+        sampler = "sampler agent" if self.sampler_agent is not None else "controller process"
+        return (f"{sampler}: CPU {self.system_data.mean('monitor_cpu_percent'):.1f}% "
+                f"(max {self.system_data.max('monitor_cpu_percent'):.1f}%), "
+                f"RSS {self.system_data.mean('monitor_rss_mb'):.0f}MB")
+
+    def get_disk_io(self) -> str:
+        """:return: the average IO of every disk, one line per disk"""
+        disk_io = ''
+        for device in self.system_sampler.disk_devices:
+            averages = {metric: self.system_data.mean(f"disk_{device}_{metric}")
+                        for metric in SystemSampler.DISK_METRICS}
+            disk_io += (f"{device}: read {averages['read_iops']:.0f} IOPS, write {averages['write_iops']:.0f} IOPS, "
+                        f"busy {averages['busy']:.1f}%, await {averages['await']:.2f}ms\n")
+        return disk_io
+
+    def get_network_io(self) -> str:
+        """:return: the average throughput and the dropped packets of every network interface"""
+        network_io = ''
+        for nic in self.system_sampler.network_interfaces:
+            network_io += (f"{nic}: rx {self.system_data.mean(f'nic_{nic}_rx_speed'):.2f}MB/s, "
+                           f"tx {self.system_data.mean(f'nic_{nic}_tx_speed'):.2f}MB/s, "
+                           f"drops {self.system_data.column(f'nic_{nic}_drops').sum():.0f}\n")
+        return network_io
+
+    def get_ipc_performance_data(self) -> dict:
+        """
+        :return: the sampled averages under the IPCPerformance column names, with one value per GPU in
+                 gpus_usage_avg and gpus_memory_usage_avg, per disk in disk_* and per network interface in network_*
+        """
+        disk_devices = self.system_sampler.disk_devices
+        network_interfaces = self.system_sampler.network_interfaces
+        return {
+            "model_size": self.data_monitor_config["model_resolution"],
+            "network_architecture": self.data_monitor_config["network_architecture"],
+            "cpu_usage_avg": self.system_data.mean("cpu_usage"),
+            "gpus_usage_avg": [self.system_data.mean(f"gpu{gpu_index}_usage") for gpu_index in range(self.gpu_count)],
+            "gpus_memory_usage_avg": [self.system_data.mean(f"gpu{gpu_index}_mem_usage")
+                                      for gpu_index in range(self.gpu_count)],
+            "memory_usage_avg": self.system_data.mean("memory_usage"),
+            "disk_usage_avg": self.system_data.mean("disk_usage"),
+            "disk_read_speed_avg": self.system_data.mean("disk_read_speed"),
+            "disk_write_speed_avg": self.system_data.mean("disk_write_speed"),
+            "disk_devices": disk_devices,
+            "disk_read_iops_avg": [self.system_data.mean(f"disk_{device}_read_iops") for device in disk_devices],
+            "disk_write_iops_avg": [self.system_data.mean(f"disk_{device}_write_iops") for device in disk_devices],
+            "disk_busy_avg": [self.system_data.mean(f"disk_{device}_busy") for device in disk_devices],
+            "disk_await_avg": [self.system_data.mean(f"disk_{device}_await") for device in disk_devices],
+            "network_interfaces": network_interfaces,
+            "network_rx_speed_avg": [self.system_data.mean(f"nic_{nic}_rx_speed") for nic in network_interfaces],
+            "network_tx_speed_avg": [self.system_data.mean(f"nic_{nic}_tx_speed") for nic in network_interfaces],
+            "network_drops": [int(self.system_data.column(f"nic_{nic}_drops").sum()) for nic in network_interfaces],
+        }
+
     def get_prod_info(self) -> (list, str):
         camera_resolution = self.data_monitor_config["camera_resolution"]
         model_resize = self.data_monitor_config["model_resolution"]
@@ -407,90 +580,106 @@ class DataMonitor(object):
         return [camera_resolution, model_resize, network_architecture, software_version, ng_type_number,
                 each_ng_type_defect_number, is_image_saving], core_allocation
 
+    def render_system_data_charts(self, core_owners: dict, saturated_cores: list) -> list:
+        """
+        Render the image charts of the system data in memory, in parallel, see render_charts.
+        The line charts are only rendered with the "report_chart_images" config key, they are native Excel charts
+        by default, see get_system_data_series. The number of processes can be set by the "chart_workers" config key.
+        :return: [(PNG, top left cell), ...]
+        """
+        sample_time = self.system_data.timestamps()
+        jobs = []
+        cells = []
+        if self.data_monitor_config.get("report_chart_images", False):
+            jobs += [(render_line_chart, {"data": self.system_data.column(column), "title": title,
+                                          "sample_time": sample_time})
+                     for column, title, _ in self.SYSTEM_DATA_CHARTS]
+            cells += [cell for _, _, cell in self.SYSTEM_DATA_CHARTS]
+        core_labels = [f"{core} ({', '.join(core_owners[core])})" if core in core_owners else str(core)
+                       for core in range(self.core_count)]
+        jobs.append((render_heatmap, {"data": self.system_data.matrix(self.get_cpu_core_columns()),
+                                      "title": "CPU Core Usage (%)", "sample_time": sample_time,
+                                      "row_labels": core_labels, "highlighted_rows": saturated_cores}))
+        cells.append(self.CPU_CORES_HEATMAP_CELL)
+        charts = render_charts(jobs, max_workers=self.data_monitor_config.get("chart_workers"))
+        return list(zip(charts, cells))
+
+    def get_system_data_series(self) -> (dict, list):
+        """
+        The system data charts as native Excel charts, every series downsampled with LTTB to at most
+        "report_max_samples" samples.
+        :return: {column: (seconds since the first sample, values)}, [(column, title, x axis title, cell), ...]
+        """
+        if self.data_monitor_config.get("report_chart_images", False):
+            return {}, []
+        max_samples = self.data_monitor_config.get("report_max_samples", self.REPORT_MAX_SAMPLES)
+        sample_time = self.system_data.timestamps()
+        elapsed = sample_time - sample_time[0] if len(sample_time) else sample_time
+        series = {column: lttb(elapsed, self.system_data.column(column), max_samples)
+                  for column, _, _ in self.SYSTEM_DATA_CHARTS}
+        charts = [(column, title, "Time (s)", cell) for column, title, cell in self.SYSTEM_DATA_CHARTS]
+        return series, charts
+
+    def archive_run(self, end_time: str, benchmark_data: dict) -> str:
+        """
+        Write the samples and the log events of the run into a RunArchive under RUN_ARCHIVE_LOCATION.
+        :return: the path of the archive, kept in self.run_archive_path for SimulationResult.run_archive_path
+        """
+        run_name = re.sub(r'[^\w.-]', '_', f"{self.data_monitor_config['edge_name']}_"
+                                            f"{self.data_monitor_config['camera_resolution']}_"
+                                            f"{self.data_monitor_config['model_resolution']}_{end_time}")
+        path = os.path.join(str(RUN_ARCHIVE_LOCATION), run_name)
+        self.run_archive_path = None
+        metadata = {"start_time": self.log_start_time, "end_time": end_time, "sample_interval": self.sample_interval,
+                    "missed_ticks": self.missed_ticks, "config": self.data_monitor_config,
+                    "benchmark_data": benchmark_data}
+        try:
+            RunArchive.write(path, self.system_data, self.log_events, metadata,
+                             compressed=self.data_monitor_config.get("run_archive_compressed", True))
+        except OSError as e:
+            logger.error(f"{self.__class__.__name__} failed to archive the run to {path}: {e}")
+            return None
+        self.run_archive_path = path
+        return path
+
     def create_report(self, benchmark_data: dict):
+        """:raise RuntimeError: the sampler agent exited before stop_system_data, see SamplerAgent.check"""
+        if self.sampler_agent is not None:
+            self.sampler_agent.check()
         end_time = self.get_current_time()
-        result_log = self.grep_logs_between_start_end(PROD_LOG_PATH, self.log_start_time, end_time)
-        if "data" in self.wb.sheetnames:
-            data_ws = self.wb["data"]
-        else:
-            data_ws = self.wb.create_sheet(title="data")
-
-        if data_ws.max_row == 1:
-            data_ws.append([
-                # System Info
-                "Edge Name", "Camera Resolution", "Model Resize", "Network Architecture", "Software Version",
-                "NG Type Number", 'Each NG Type Defect Number', "Is Image Saving",
-
-                # Benchmark Data
-                "Part Count", "Total Use Time(s)", "FPS", "MP/s", "Max Part Use Time (s)", "Min Part Use Time (s)",
-                "Avg Part Use Time (s)", "Max Cortex Infer Time (ms)", "Min Cortex Infer Time (ms)",
-                "Avg Cortex Infer Time (ms)",
-
-                # System Data
-                "CPU", "GPU", "RAM", "SSD", "CPU Usage AVG (%)", "GPU Usage AVG (%)", "GPU Memory Usage AVG (%)",
-                "Memory Usage AVG (%)", "Disk Usage AVG (%)", "Disk Read Speed AVG (MB/s)",
-                "Disk Write Speed AVG (MB/s)",
-
-                # Core Allocation
-                "Core Allocation", "Created At"
-            ])
+        # reports created before a column was added get its header cell too
+        self.report_store.set_header(self.REPORT_HEADER)
         prod_info, core_allocation = self.get_prod_info()
         mps = int(self.data_monitor_config['model_resolution'].split('mp')[0]) * benchmark_data['fps']
         edge_name = self.data_monitor_config['edge_name']
-        data_ws.append([edge_name] + prod_info + list(benchmark_data.values()) + [mps] + self.calculate_part_time(
-            result_log) + self.calculate_cortex_infer_time(result_log) + self.get_system_info() +
-                       [sum(self.cpu_usage) / len(self.cpu_usage),
-                        sum(self.gpu_usage) / len(self.gpu_usage),
-                        sum(self.gpu_mem_usage) / len(
-                            self.gpu_mem_usage),
-                        sum(self.memory_usage) / len(self.memory_usage),
-                        sum(self.disk_usage) / len(self.disk_usage),
-                        sum(self.disk_read_speed) / len(
-                            self.disk_read_speed),
-                        sum(self.disk_write_speed) / len(
-                            self.disk_write_speed)] + [core_allocation, end_time])
-        for column in data_ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except Exception as e:
-                    logger.error(f"{inspect.currentframe().f_code.co_name} raise error: {e}")
-            adjusted_width = (max_length + 2)
-            data_ws.column_dimensions[column_letter].width = adjusted_width
+        log_metrics = self.analyze_logs(end_time)
+        ipc_performance = self.get_ipc_performance_data()
+        core_owners = self.get_core_owners()
+        saturated_cores = self.get_saturated_cores()
+        report_row = ([edge_name] + prod_info + list(benchmark_data.values()) + [mps] + log_metrics["part_time"] +
+                      log_metrics["cortex_infer_time"] + self.get_system_info() +
+                      [self.system_data.mean(column) for column in self.SYSTEM_DATA_COLUMNS] +
+                      [core_allocation, end_time] +
+                      [self.latency_percentiles[f"{percentile}_{latency_name}"]
+                       for latency_name in ("part_use_time", "cortex_infer_time")
+                       for percentile in ("p50", "p95", "p99")] +
+                      [log_metrics["part_timeline"]["incomplete_parts"],
+                       self.get_bottleneck_summary(log_metrics["part_timeline"])] +
+                      [str(ipc_performance["gpus_usage_avg"]), str(ipc_performance["gpus_memory_usage_avg"])] +
+                      [self.system_data.mean(f"{name}_gpu_memory") for name in self.GPU_PROCESSES] +
+                      [self.get_process_usage(), self.get_saturated_core_summary(saturated_cores, core_owners)] +
+                      [self.get_monitor_overhead(), self.get_disk_io(), self.get_network_io()])
+        self.report_store.append_row(report_row)
+        if self.data_monitor_config.get("run_archive", True):
+            self.archive_run(end_time, benchmark_data)
 
         plt_worksheet_name = (f'{edge_name}_{self.data_monitor_config["camera_resolution"]}'
                               f'_{self.data_monitor_config["model_resolution"]}')[:31]
-        if plt_worksheet_name in self.wb.sheetnames:
-            del self.wb[plt_worksheet_name]
-        chart_ws = self.wb.create_sheet(title=plt_worksheet_name)
-
-        self.plot_and_insert(self.cpu_usage, "CPU Usage (%)", "A1", chart_ws, self.all_params)
-        self.plot_and_insert(self.gpu_usage, "GPU Usage (%)", "R1", chart_ws, self.all_params)
-        self.plot_and_insert(self.gpu_mem_usage, "GPU Memory Usage (%)", "AI1", chart_ws, self.all_params)
-        self.plot_and_insert(self.memory_usage, "Memory Usage (%)", "A36", chart_ws, self.all_params)
-        self.plot_and_insert(self.disk_usage, "Disk Usage (%)", "R36", chart_ws, self.all_params)
-        self.plot_and_insert(self.disk_read_speed, "Disk Read Speed (MB/s)", "AI36", chart_ws, self.all_params)
-        self.plot_and_insert(self.disk_write_speed, "Disk Write Speed (MB/s)", "AZ36", chart_ws, self.all_params)
-
-        if 'Sheet' in self.wb.sheetnames:
-            del self.wb['Sheet']
-
-        self.wb.save(self.REPORT_FILE_NAME)
-        self.all_params.clear()
-
-    def get_image_capture_time_cost(self):
-        pass
-        # !todo 获取Optix获取每张图片的耗时，然后统计平均耗时，并获取最大耗时
-
-
-
-
-
-
-
-
-
-
+        series, charts = self.get_system_data_series()
+        self.report_store.set_chart_sheet(plt_worksheet_name, self.render_system_data_charts(core_owners,
+                                                                                           saturated_cores),
+                                          series=series, charts=charts)
+
+        # the workbook is generated on demand, see export_report
+        if self.data_monitor_config.get("export_report", False):
+            self.export_report()
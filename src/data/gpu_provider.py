@@ -0,0 +1,126 @@
+# coding: utf-8
+
+from collections import namedtuple
+from typing import Iterable, Sequence
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+# utilization in %, memory in bytes
+GpuSample = namedtuple("GpuSample", ["utilization", "memory_used", "memory_total"])
+
+
+class GpuProvider(object):
+    """Source of the GPU data sampled by DataMonitor, one entry per device."""
+
+    def device_count(self) -> int:
+        raise NotImplementedError
+
+    def sample(self) -> list:
+        """:return: [GpuSample, ...] in device order"""
+        raise NotImplementedError
+
+    def process_memory(self, pids: Iterable[int]) -> dict:
+        """:return: {pid: GPU memory used by the process in bytes, summed over all devices}"""
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class NvmlGpuProvider(GpuProvider):
+    """
+    GPU data read through NVML. pynvml is imported and NVML initialized on first use, so creating the provider
+    costs nothing on machines that never sample.
+    """
+
+    def __init__(self):
+        self._pynvml = None
+        self._handles = None
+
+    def __reduce__(self):
+        # NVML handles are only valid in the process that initialized NVML, a copy initializes it again
+        return self.__class__, ()
+
+    @property
+    def handles(self) -> list:
+        if self._handles is None:
+            import pynvml
+
+            pynvml.nvmlInit()
+            self._pynvml = pynvml
+            self._handles = [pynvml.nvmlDeviceGetHandleByIndex(index) for index in range(pynvml.nvmlDeviceGetCount())]
+        return self._handles
+
+    def device_count(self) -> int:
+        return len(self.handles)
+
+    def sample(self) -> list:
+        samples = []
+        for handle in self.handles:
+            utilization = self._pynvml.nvmlDeviceGetUtilizationRates(handle)
+            memory = self._pynvml.nvmlDeviceGetMemoryInfo(handle)
+            samples.append(GpuSample(utilization.gpu, memory.used, memory.total))
+        return samples
+
+    def process_memory(self, pids: Iterable[int]) -> dict:
+        memory = {pid: 0 for pid in pids}
+        for handle in self.handles:
+            try:
+                processes = self._pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            except self._pynvml.NVMLError as e:
+                logger.error(f"{self.__class__.__name__} failed to list the GPU processes: {e}")
+                continue
+            for process in processes:
+                # usedGpuMemory is None when the driver does not expose it, e.g. on Windows WDDM
+                if process.pid in memory and process.usedGpuMemory:
+                    memory[process.pid] += process.usedGpuMemory
+        return memory
+
+    def shutdown(self):
+        if self._handles is not None:
+            self._pynvml.nvmlShutdown()
+            self._handles = None
+
+
+class NullGpuProvider(GpuProvider):
+    """A machine without GPU: no device, no sample and no GPU memory for any process."""
+
+    def device_count(self) -> int:
+        return 0
+
+    def sample(self) -> list:
+        return []
+
+    def process_memory(self, pids: Iterable[int]) -> dict:
+        return {pid: 0 for pid in pids}
+
+
+class FakeGpuProvider(GpuProvider):
+    """Replays fixed GPU data, to test the sampling and the report on machines without an NVIDIA GPU."""
+
+    def __init__(self, samples: Sequence[GpuSample], process_memory: dict = None):
+        self.samples = list(samples)
+        self.fake_process_memory = process_memory or {}
+
+    def device_count(self) -> int:
+        return len(self.samples)
+
+    def sample(self) -> list:
+        return list(self.samples)
+
+    def process_memory(self, pids: Iterable[int]) -> dict:
+        return {pid: self.fake_process_memory.get(pid, 0) for pid in pids}
+
+
+def create_gpu_provider() -> GpuProvider:
+    """:return: an NvmlGpuProvider, or a NullGpuProvider when pynvml or the NVIDIA driver is not available"""
+    provider = NvmlGpuProvider()
+    try:
+        provider.device_count()
+    except Exception as e:
+        # pynvml raises NVMLError_LibraryNotFound or NVMLError_DriverNotLoaded on machines without NVIDIA GPU
+        logger.warning(f"{create_gpu_provider.__name__} found no NVIDIA GPU, sampling without GPU data: {e}")
+        return NullGpuProvider()
+    return provider
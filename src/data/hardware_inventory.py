@@ -0,0 +1,155 @@
+# coding: utf-8
+
+import hashlib
+import importlib
+import json
+import os
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from typing import Callable, Dict, Sequence
+
+import psutil
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+LINUX_BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def get_boot_id() -> str:
+    """:return: an id that changes on every reboot, hardware is only swapped while the IPC is off"""
+    try:
+        with open(LINUX_BOOT_ID_PATH, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return str(int(psutil.boot_time()))
+
+
+def get_hardware_fingerprint() -> str:
+    """:return: a hash of the hardware facts that are cheap to read, without any subprocess"""
+    facts = [platform.node(), platform.machine(), platform.processor(), psutil.cpu_count(),
+             psutil.virtual_memory().total]
+    try:
+        facts += sorted(os.listdir("/sys/block"))
+    except OSError:
+        facts += sorted(partition.device for partition in psutil.disk_partitions())
+    return hashlib.sha1(json.dumps(facts, default=str).encode()).hexdigest()
+
+
+class HardwareInventory(object):
+    """
+    Hardware inventory of the IPC, collected once and cached on disk.
+
+    Every collector (e.g. the CPU model through cpuinfo, the memory modules through dmidecode) is run
+    concurrently, because most of them wait for a subprocess. The result is cached in a JSON file keyed by
+    the boot id and a fingerprint of the hardware, so it is only collected after a reboot or a hardware change.
+    Without a valid cache, refresh_in_background collects it in a daemon thread that writes the cache, and get
+    waits for that thread instead of collecting again. The modules of the collectors are imported in the calling
+    thread first, so the collector threads do not import while the caller starts up.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, collectors: Dict[str, Callable], cache_path, modules: Sequence[str] = ()):
+        """
+        :param collectors: {inventory key: function returning its value}, the values have to be JSON serializable
+        :param cache_path: JSON file the inventory is cached in
+        :param modules: modules the collectors import, missing ones are left to the collectors to report
+        """
+        self.collectors = collectors
+        self.cache_path = str(cache_path)
+        self.modules = modules
+        self.inventory = None
+        self.thread = None
+        self._lock = Lock()
+
+    def cache_key(self) -> dict:
+        return {"version": self.CACHE_VERSION, "boot_id": get_boot_id(), "fingerprint": get_hardware_fingerprint(),
+                "collectors": sorted(self.collectors)}
+
+    def load_cache(self):
+        """:return: the cached inventory, None when there is none for the current boot and hardware"""
+        try:
+            with open(self.cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get("key") != self.cache_key():
+            return None
+        return cache.get("inventory")
+
+    def save_cache(self, inventory: dict):
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump({"key": self.cache_key(), "inventory": inventory}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            # the inventory is still returned, it is only collected again next time
+            logger.warning(f"{self.__class__.__name__} failed to save {self.cache_path}: {e}")
+
+    def import_modules(self):
+        for module in self.modules:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                logger.warning(f"{self.__class__.__name__} failed to import {module}: {e}")
+
+    def collect(self) -> dict:
+        """Run every collector concurrently and cache the result, the collector threads are joined on return."""
+        self.import_modules()
+        with ThreadPoolExecutor(max_workers=len(self.collectors) or 1) as executor:
+            futures = {key: executor.submit(collector) for key, collector in self.collectors.items()}
+        inventory = {}
+        for key, future in futures.items():
+            try:
+                inventory[key] = future.result()
+            except Exception as e:
+                logger.error(f"{self.__class__.__name__} failed to collect {key}: {e}")
+                inventory[key] = None
+        with self._lock:
+            self.inventory = inventory
+        self.save_cache(inventory)
+        return inventory
+
+    def refresh_in_background(self) -> Thread:
+        """Load the cache at once, and collect the inventory in a daemon thread when the cache is not valid."""
+        with self._lock:
+            if self.inventory is None:
+                self.inventory = self.load_cache()
+            if self.inventory is not None or (self.thread is not None and self.thread.is_alive()):
+                return self.thread
+        self.import_modules()
+        self.thread = Thread(target=self.collect, name="hardware_inventory", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def get(self) -> dict:
+        """
+        :return: {inventory key: value}, from the cache when it is valid, otherwise from the background collection,
+                 which is waited for, or collected now
+        """
+        with self._lock:
+            if self.inventory is None:
+                self.inventory = self.load_cache()
+            inventory = self.inventory
+        if inventory is not None:
+            return inventory
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+            return self.inventory
+        return self.collect()
+
+    def to_ipc_config(self, name: str, software_version: str) -> dict:
+        """:return: the inventory under the IPCConfig column names, see IPCConfig.add_data"""
+        inventory = self.get()
+        return {
+            "name": name,
+            "cpu": inventory.get("cpu") or "",
+            "gpus": inventory.get("gpus") or [],
+            "ram": inventory.get("ram") or "",
+            "ssds": inventory.get("ssds") or [],
+            "software_version": software_version,
+        }
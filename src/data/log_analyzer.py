@@ -0,0 +1,607 @@
+# coding: utf-8
+
+import os
+import re
+import math
+import time
+import multiprocessing
+from array import array
+from datetime import datetime
+from threading import Thread, Lock
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional
+
+from log import formatted_logging
+from src.data.log_reader import (get_timestamp_key, find_window_offset, discover_log_segments,
+                                 iter_logs_between_start_end, LogTailer)
+from src.data.quantile_sketch import DDSketch
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+
+@lru_cache(maxsize=4096)
+def _timestamp_key_to_epoch(key: str) -> float:
+    return datetime.strptime(key, '%Y-%m-%d %H:%M:%S').timestamp()
+
+
+_FRACTION_PATTERN = re.compile(r"\.\d+")
+
+
+# several metrics usually parse the timestamp of the same line one after the other
+@lru_cache(maxsize=16)
+def get_line_timestamp(line: str) -> Optional[float]:
+    """
+    Same result as DataMonitor.get_timestamp_from_log, but only parses each second once and keeps the '.%f'
+    fraction with a float conversion instead of strptime.
+    """
+    key = get_timestamp_key(line)
+    if key is None:
+        return None
+    timestamp = _timestamp_key_to_epoch(key)
+    fraction = _FRACTION_PATTERN.match(line, line.find(key) + len(key))
+    if fraction:
+        timestamp += float(fraction.group())
+    return timestamp
+
+
+class RunningStats(object):
+    """Count, sum, min, max and a quantile sketch of a metric, updated in O(1) per sample."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = DDSketch()
+
+    def add(self, value: float):
+        self.sketch.add(value)
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other: "RunningStats"):
+        self.sketch.merge(other.sketch)
+        self.count += other.count
+        self.total += other.total
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        if other.maximum is not None and (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+        return self
+
+    def to_list(self) -> list:
+        """:return: [max, min, avg], [0, 0, 0] without samples"""
+        if not self.count:
+            return [0, 0, 0]
+        return [self.maximum, self.minimum, self.total / self.count]
+
+    def percentiles(self) -> list:
+        """:return: [p50, p95, p99], [0, 0, 0] without samples"""
+        return self.sketch.percentiles()
+
+
+class LogMetric(object):
+    """
+    A metric computed from prod.log lines.
+
+    Subclasses register their line matchers in `matchers()`: a literal that must be in the line, which is
+    checked first because `in` is much cheaper than a regex, an optional precompiled regex that must then
+    match, and the handler called with the line and the match object.
+    """
+    name = ""
+
+    def matchers(self) -> list:
+        """:return: [(literal, compiled regex or None, handler(line, match)), ...]"""
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def merge(self, other: "LogMetric"):
+        """
+        Add the state of the same metric computed over the log that directly follows this one, so that
+        segments analyzed separately give the same result as a single pass over all of them.
+        """
+        raise NotImplementedError
+
+    def sketches(self) -> dict:
+        """:return: {latency name: DDSketch} of the latencies measured by the metric"""
+        return {}
+
+    def events(self) -> dict:
+        """:return: {column name: sequence} of the parsed events kept by the metric, see RunArchive"""
+        return {}
+
+
+class PartTimeMetric(LogMetric):
+    """Time from 'Starting part group with parts' to 'Marking part group as done' of every part group."""
+    name = "part_time"
+    GROUP_ID_PATTERN = re.compile(r"'group_id': '([^']*)'")
+
+    def __init__(self):
+        self.start_part_time = {}
+        # done events whose start was logged before the analyzed lines, matched on merge
+        self.orphan_done_time = {}
+        self.stats = RunningStats()
+
+    def matchers(self) -> list:
+        return [
+            ('Starting part group with parts', self.GROUP_ID_PATTERN, self.on_part_start),
+            ('Marking part group as done', self.GROUP_ID_PATTERN, self.on_part_done),
+        ]
+
+    def on_part_start(self, line: str, match):
+        timestamp = get_line_timestamp(line)
+        if timestamp is not None:
+            self.start_part_time[match.group(1)] = timestamp
+
+    def on_part_done(self, line: str, match):
+        timestamp = get_line_timestamp(line)
+        if timestamp is None:
+            return
+        start_time = self.start_part_time.pop(match.group(1), None)
+        if start_time is not None:
+            self.stats.add(timestamp - start_time)
+        else:
+            self.orphan_done_time[match.group(1)] = timestamp
+
+    def merge(self, other: "PartTimeMetric"):
+        for group_id, done_time in other.orphan_done_time.items():
+            start_time = self.start_part_time.pop(group_id, None)
+            if start_time is not None:
+                self.stats.add(done_time - start_time)
+            else:
+                self.orphan_done_time[group_id] = done_time
+        self.start_part_time.update(other.start_part_time)
+        self.stats.merge(other.stats)
+        return self
+
+    def result(self) -> list:
+        return self.stats.to_list()
+
+    def sketches(self) -> dict:
+        return {"part_use_time": self.stats.sketch}
+
+
+class CortexInferTimeMetric(LogMetric):
+    """获取Cortex推理每张图片的耗时，然后统计平均耗时，并获取最大耗时"""
+    name = "cortex_infer_time"
+    INFER_TIME_PATTERN = re.compile(r"(\d+)\s*$")
+
+    def __init__(self):
+        self.stats = RunningStats()
+
+    def matchers(self) -> list:
+        return [('cortex batch inference on', self.INFER_TIME_PATTERN, self.on_infer)]
+
+    def on_infer(self, line: str, match):
+        self.stats.add(int(match.group(1)))
+
+    def merge(self, other: "CortexInferTimeMetric"):
+        self.stats.merge(other.stats)
+        return self
+
+    def result(self) -> list:
+        return self.stats.to_list()
+
+    def sketches(self) -> dict:
+        return {"cortex_infer_time": self.stats.sketch}
+
+
+class ImageCaptureTimeMetric(LogMetric):
+    """获取Optix获取每张图片的耗时，然后统计平均耗时，并获取最大耗时"""
+    name = "image_capture_time"
+    IMAGE_CAPTURE_PATTERN = re.compile(r"capture_image took ([\d.]+) seconds")
+
+    def __init__(self):
+        self.stats = RunningStats()
+
+    def matchers(self) -> list:
+        return [('capture_image took', self.IMAGE_CAPTURE_PATTERN, self.on_capture)]
+
+    def on_capture(self, line: str, match):
+        self.stats.add(float(match.group(1)))
+
+    def merge(self, other: "ImageCaptureTimeMetric"):
+        self.stats.merge(other.stats)
+        return self
+
+    def result(self) -> list:
+        return self.stats.to_list()
+
+    def sketches(self) -> dict:
+        return {"image_capture_time": self.stats.sketch}
+
+
+class Generate25DTimeMetric(LogMetric):
+    """generate_overlaid_image_25d time cost of every capture config"""
+    name = "generate_25d_time"
+    GENERATE_25D_PATTERN = re.compile(r"generate_overlaid_image_25d took ([\d.]+) seconds")
+    CAPTURE_CONFIGS = {"normal": "capture_config: NORMAL", "mean": "capture_config: MEAN",
+                       "height": "capture_config: HEIGHT"}
+
+    def __init__(self):
+        self.stats = {capture_config: RunningStats() for capture_config in self.CAPTURE_CONFIGS}
+
+    def matchers(self) -> list:
+        return [('generate_overlaid_image_25d took', None, self.on_generate)]
+
+    def on_generate(self, line: str, match):
+        match = self.GENERATE_25D_PATTERN.search(line)
+        if not match:
+            logger.error(f"{self.GENERATE_25D_PATTERN.pattern} not in line {line}")
+            return
+        for capture_config, capture_config_text in self.CAPTURE_CONFIGS.items():
+            if capture_config_text in line:
+                self.stats[capture_config].add(float(match.group(1)))
+                break
+
+    def merge(self, other: "Generate25DTimeMetric"):
+        for capture_config, stats in self.stats.items():
+            stats.merge(other.stats[capture_config])
+        return self
+
+    def result(self) -> dict:
+        """:return: {"normal": [max, min, avg], "mean": [max, min, avg], "height": [max, min, avg]}"""
+        return {capture_config: stats.to_list() for capture_config, stats in self.stats.items()}
+
+    def sketches(self) -> dict:
+        return {f"25d_{capture_config}_time": stats.sketch for capture_config, stats in self.stats.items()}
+
+
+class PartTimelineMetric(LogMetric):
+    """
+    Per part group timeline: first and last timestamp of every stage event of each part.
+
+    The timeline is stored column-wise, one array('d') per stage bound with NaN for missing events and a
+    row per group id, so hundreds of thousands of parts cost a few bytes per stage each. Stage events are
+    attributed to a part through the group id in the line; events without one are only counted.
+    """
+    name = "part_timeline"
+    STAGES = ("start", "capture", "generate_25d", "cortex_infer", "done")
+    EVENT_GROUP_ID_PATTERN = re.compile(r"group_id['\"]?\s*[:=]\s*['\"]?([\w.-]+)")
+
+    def __init__(self):
+        self.group_ids = []
+        self.row_of_group = {}
+        self.first_time = {stage: array('d') for stage in self.STAGES}
+        self.last_time = {stage: array('d') for stage in self.STAGES}
+        self.unattributed_events = {stage: 0 for stage in self.STAGES}
+
+    def matchers(self) -> list:
+        return [
+            ('Starting part group with parts', PartTimeMetric.GROUP_ID_PATTERN, self._stage_handler("start")),
+            ('capture_image took', None, self._stage_handler("capture")),
+            ('generate_overlaid_image_25d took', None, self._stage_handler("generate_25d")),
+            ('cortex batch inference on', None, self._stage_handler("cortex_infer")),
+            ('Marking part group as done', PartTimeMetric.GROUP_ID_PATTERN, self._stage_handler("done")),
+        ]
+
+    def _stage_handler(self, stage: str):
+        def on_stage_event(line: str, match):
+            if match is None:
+                match = self.EVENT_GROUP_ID_PATTERN.search(line)
+                if match is None:
+                    self.unattributed_events[stage] += 1
+                    return
+            timestamp = get_line_timestamp(line)
+            if timestamp is not None:
+                self.add_event(match.group(1), stage, timestamp)
+        return on_stage_event
+
+    def add_event(self, group_id: str, stage: str, timestamp: float):
+        row = self.row_of_group.get(group_id)
+        if row is None:
+            row = len(self.group_ids)
+            self.row_of_group[group_id] = row
+            self.group_ids.append(group_id)
+            for stage_name in self.STAGES:
+                self.first_time[stage_name].append(math.nan)
+                self.last_time[stage_name].append(math.nan)
+        if math.isnan(self.first_time[stage][row]):
+            self.first_time[stage][row] = timestamp
+        self.last_time[stage][row] = timestamp
+
+    def events(self) -> dict:
+        """:return: the group id and the first and last timestamp of every stage, one row per part group"""
+        events = {"group_id": list(self.group_ids)}
+        for stage in self.STAGES:
+            events[f"{stage}_first_time"] = self.first_time[stage]
+            events[f"{stage}_last_time"] = self.last_time[stage]
+        return events
+
+    def merge(self, other: "PartTimelineMetric"):
+        for other_row, group_id in enumerate(other.group_ids):
+            for stage in self.STAGES:
+                first_time = other.first_time[stage][other_row]
+                if not math.isnan(first_time):
+                    self.add_event(group_id, stage, first_time)
+                    self.add_event(group_id, stage, other.last_time[stage][other_row])
+        for stage, count in other.unattributed_events.items():
+            self.unattributed_events[stage] += count
+        return self
+
+    def result(self) -> dict:
+        """
+        :return: {"parts": part count, "incomplete_parts": parts without a start or done event,
+                  "incomplete_group_ids": [...], "unattributed_events": {stage: count},
+                  "stages": {stage: {"duration": [max, min, avg], "gap": [max, min, avg]}},
+                  "bottleneck": the stage with the largest average duration + gap, None when no stage but done
+                  was measured, e.g. the stage lines carry no group id, see unattributed_events}
+                 duration is the time from the first to the last event of the stage, gap the time from the
+                 last event of the previous stage of the part to the first event of this one (queueing).
+        """
+        durations = {stage: RunningStats() for stage in self.STAGES[1:]}
+        gaps = {stage: RunningStats() for stage in self.STAGES[1:]}
+        incomplete_group_ids = []
+        for row, group_id in enumerate(self.group_ids):
+            if math.isnan(self.first_time["start"][row]) or math.isnan(self.first_time["done"][row]):
+                incomplete_group_ids.append(group_id)
+                continue
+            previous_last_time = self.last_time["start"][row]
+            for stage in self.STAGES[1:]:
+                first_time = self.first_time[stage][row]
+                if math.isnan(first_time):
+                    continue
+                durations[stage].add(self.last_time[stage][row] - first_time)
+                gaps[stage].add(first_time - previous_last_time)
+                previous_last_time = self.last_time[stage][row]
+
+        stages = {stage: {"duration": durations[stage].to_list(), "gap": gaps[stage].to_list()}
+                  for stage in self.STAGES[1:]}
+        # done only marks the end of the part, it is no stage of the pipeline
+        measured_stages = [stage for stage in self.STAGES[1:-1] if durations[stage].count]
+        bottleneck = max(measured_stages, key=lambda stage: stages[stage]["duration"][2] + stages[stage]["gap"][2],
+                         default=None)
+        return {
+            "parts": len(self.group_ids),
+            "incomplete_parts": len(incomplete_group_ids),
+            "incomplete_group_ids": incomplete_group_ids,
+            "unattributed_events": dict(self.unattributed_events),
+            "stages": stages,
+            "bottleneck": bottleneck,
+        }
+
+
+class LogAnalyzer(object):
+    """
+    Compute every registered LogMetric in a single pass over a stream of log lines.
+
+    After `analyze`, `throughput` holds the lines, characters and seconds of the pass with lines/s and MB/s,
+    so the parser speed can be compared between versions.
+    """
+
+    def __init__(self, metrics: Iterable[LogMetric] = ()):
+        self.metrics = {}
+        self._matchers = []
+        self.throughput = {}
+        for metric in metrics:
+            self.register(metric)
+
+    def register(self, metric: LogMetric) -> LogMetric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered!")
+        self.metrics[metric.name] = metric
+        self._matchers.extend(metric.matchers())
+        return metric
+
+    def feed(self, line: str):
+        for literal, pattern, handler in self._matchers:
+            if literal in line:
+                if pattern is None:
+                    handler(line, None)
+                else:
+                    match = pattern.search(line)
+                    if match:
+                        handler(line, match)
+
+    def analyze(self, lines: Iterable[str]) -> dict:
+        """
+        :param lines: log lines, typically a generator from grep_logs_between_start_end
+        :return: {metric name: metric result}
+        """
+        feed = self.feed
+        line_count = 0
+        char_count = 0
+        start = time.perf_counter()
+        for line in lines:
+            line_count += 1
+            char_count += len(line) + 1
+            feed(line)
+        elapsed = time.perf_counter() - start
+
+        self.throughput = {
+            "lines": line_count,
+            "mb": char_count / (1024 * 1024),
+            "seconds": elapsed,
+            "lines_per_second": line_count / elapsed if elapsed > 0 else 0,
+            "mb_per_second": char_count / (1024 * 1024) / elapsed if elapsed > 0 else 0,
+        }
+        logger.info(f"{self.__class__.__name__} parsed {line_count} lines ({self.throughput['mb']:.1f} MB) in "
+                    f"{elapsed:.3f}s, {self.throughput['lines_per_second']:.0f} lines/s, "
+                    f"{self.throughput['mb_per_second']:.1f} MB/s")
+        return self.results()
+
+    def results(self) -> dict:
+        return {name: metric.result() for name, metric in self.metrics.items()}
+
+    def merge(self, metrics: dict, throughput: dict):
+        """
+        Merge the metrics and throughput of an analyzer run over the log that directly follows this one.
+        :param metrics: {metric name: LogMetric} of the other analyzer, with the same metrics registered
+        """
+        for name, metric in self.metrics.items():
+            metric.merge(metrics[name])
+        for key in ("lines", "mb", "seconds"):
+            self.throughput[key] = self.throughput.get(key, 0) + throughput.get(key, 0)
+
+    def sketches(self) -> dict:
+        """:return: {latency name: DDSketch} of every registered metric"""
+        sketches = {}
+        for metric in self.metrics.values():
+            sketches.update(metric.sketches())
+        return sketches
+
+    def events(self) -> dict:
+        """:return: {metric name: metric events} of the metrics that keep events, see LogMetric.events"""
+        events = {}
+        for name, metric in self.metrics.items():
+            metric_events = metric.events()
+            if metric_events:
+                events[name] = metric_events
+        return events
+
+    def latency_percentiles(self) -> dict:
+        """
+        :return: {"p50_<latency name>": value, "p95_...", "p99_...", ...,
+                  "latency_sketches": {latency name: DDSketch.to_dict()}}, the SimulationResult column names
+        """
+        percentiles = {}
+        sketches = self.sketches()
+        for latency_name, sketch in sketches.items():
+            for percentile, value in zip(("p50", "p95", "p99"), sketch.percentiles()):
+                percentiles[f"{percentile}_{latency_name}"] = value
+        percentiles["latency_sketches"] = {latency_name: sketch.to_dict() for latency_name, sketch in sketches.items()}
+        return percentiles
+
+
+def create_default_analyzer() -> LogAnalyzer:
+    """The analyzer with every metric of the benchmark report registered."""
+    return LogAnalyzer([PartTimeMetric(), CortexInferTimeMetric(), ImageCaptureTimeMetric(), Generate25DTimeMetric(),
+                        PartTimelineMetric()])
+
+
+# start method of the worker processes of analyze_log_segments, as SamplerAgent.START_METHOD
+SEGMENT_WORKER_START_METHOD = "spawn"
+
+
+def analyze_log_segment(log_file: str, start_time: str, end_time: str) -> (dict, dict):
+    """
+    Run the default analyzer over the window of one log segment, in a worker process of analyze_log_segments.
+    :return: ({metric name: LogMetric}, throughput), both picklable
+    """
+    analyzer = create_default_analyzer()
+    start_offset = find_window_offset(log_file, start_time)
+    analyzer.analyze(iter_logs_between_start_end(log_file, start_time, end_time, start_offset=start_offset))
+    return analyzer.metrics, analyzer.throughput
+
+
+def analyze_log_segments(log_file: str, start_time: str, end_time: str, max_workers: int = None) -> LogAnalyzer:
+    """
+    Run the default analyzer over the window of a rotated log, with every segment (plain or gzip compressed)
+    that overlaps the window parsed in its own worker process.
+
+    The partial metrics are merged in chronological order of the segments whatever order the workers finish
+    in, so the result is the same as a single pass over the concatenated segments.
+    :return: the analyzer holding the merged metrics; throughput["seconds"] is the wall time of the whole run
+    """
+    start = time.perf_counter()
+    segments = discover_log_segments(log_file, start_time, end_time)
+    analyzer = create_default_analyzer()
+    if len(segments) <= 1:
+        # not worth the process start up
+        partial_results = [analyze_log_segment(segment, start_time, end_time) for segment in segments]
+    else:
+        # the controller runs the sampler, receiver and follower threads, forking it could copy a held lock
+        with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(segments)),
+                                 mp_context=multiprocessing.get_context(SEGMENT_WORKER_START_METHOD)) as executor:
+            futures = [executor.submit(analyze_log_segment, segment, start_time, end_time) for segment in segments]
+            partial_results = [future.result() for future in futures]
+
+    for metrics, throughput in partial_results:
+        analyzer.merge(metrics, throughput)
+    elapsed = time.perf_counter() - start
+    mb = analyzer.throughput.get("mb", 0)
+    analyzer.throughput.update({
+        "lines": analyzer.throughput.get("lines", 0),
+        "mb": mb,
+        "seconds": elapsed,
+        "segments": len(segments),
+        "lines_per_second": analyzer.throughput.get("lines", 0) / elapsed if elapsed > 0 else 0,
+        "mb_per_second": mb / elapsed if elapsed > 0 else 0,
+    })
+    logger.info(f"analyze_log_segments parsed {len(segments)} segments of {log_file}, "
+                f"{analyzer.throughput['lines']} lines ({mb:.1f} MB) in {elapsed:.3f}s")
+    return analyzer
+
+
+def analyze_metric(metric: LogMetric, lines: Iterable[str]):
+    """Run a single metric over lines, without logging the throughput of the pass."""
+    analyzer = LogAnalyzer([metric])
+    for line in lines:
+        analyzer.feed(line)
+    return metric.result()
+
+
+class LogFollower(object):
+    """
+    Feed a LogAnalyzer with the lines appended to a log while the benchmark runs.
+
+    Only lines logged from start_time on are analyzed, so `results()` holds the metrics of the run so far at
+    any moment and `stop(end_time)` leaves the final metrics without reading the log window again. The part
+    timeline of the default analyzer is followed too, it only costs a few bytes per stage of every part.
+    """
+
+    def __init__(self, log_file: str, start_time: str, analyzer: LogAnalyzer = None, poll_interval: float = 0.5):
+        self.log_file = log_file
+        self.start_time = start_time
+        self.end_time = None
+        self.analyzer = analyzer or create_default_analyzer()
+        self.poll_interval = poll_interval
+        self.thread = None
+        self.stop_follow_flag = False
+        self.line_count = 0
+        self._in_window = False
+        self._lock = Lock()
+        self._tailer = LogTailer(log_file, start_offset=find_window_offset(log_file, start_time))
+
+    def start(self) -> Thread:
+        self.thread = Thread(target=self.thread_follow, daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, end_time: str = None) -> dict:
+        """
+        Stop following after reading what was logged up to end_time ('%Y-%m-%d %H:%M:%S').
+        :return: the final metric results
+        """
+        self.end_time = end_time
+        self.stop_follow_flag = True
+        if self.thread is not None:
+            self.thread.join()
+        self.poll()
+        self._tailer.close()
+        return self.results()
+
+    def thread_follow(self):
+        while not self.stop_follow_flag:
+            self.poll()
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        lines = self._tailer.read_lines()
+        with self._lock:
+            for line in lines:
+                key = get_timestamp_key(line)
+                if key is not None:
+                    if self.end_time is not None and key > self.end_time:
+                        # the untimestamped lines that follow belong to this line, they are dropped too
+                        self._in_window = False
+                        continue
+                    self._in_window = self._in_window or key >= self.start_time
+                if self._in_window:
+                    self.line_count += 1
+                    self.analyzer.feed(line)
+
+    def results(self) -> dict:
+        with self._lock:
+            return self.analyzer.results()
+
+    def latency_percentiles(self) -> dict:
+        with self._lock:
+            return self.analyzer.latency_percentiles()
@@ -0,0 +1,362 @@
+# coding: utf-8
+
+import io
+import os
+import gzip
+import json
+import bisect
+import hashlib
+from typing import Iterator, Optional
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+# Length of '%Y-%m-%d %H:%M:%S', the second-resolution part of every prod.log timestamp.
+TIMESTAMP_KEY_LENGTH = 19
+GZIP_SUFFIX = ".gz"
+# files next to the log that share its name but are not log segments
+NON_SEGMENT_SUFFIXES = (".idx", ".tmp")
+
+
+def get_timestamp_key(line: str) -> Optional[str]:
+    """
+    Return the 'YYYY-mm-dd HH:MM:SS' part of a prod.log line, or None for lines without a timestamp
+    (tracebacks, multi-line messages). Accepts the same shapes as DataMonitor.get_timestamp_from_log:
+    plain lines and '[...]'-prefixed lines, with or without a '.%f' fraction.
+
+    The key is compared as a string, which orders the same way as the timestamp itself and avoids
+    calling strptime on every line.
+    """
+    if not line.startswith('20'):
+        bracket_end = line.find(']')
+        if bracket_end < 0:
+            return None
+        line = line[bracket_end + 1:].lstrip()
+        if not line.startswith('20'):
+            return None
+    key = line[:TIMESTAMP_KEY_LENGTH]
+    if len(key) != TIMESTAMP_KEY_LENGTH or key[4] != '-' or key[10] != ' ' or key[13] != ':':
+        return None
+    return key
+
+
+class LogOffsetIndex(object):
+    """
+    Sparse, persistent timestamp -> byte offset index of a log file, stored next to it as '<log_file>.idx'.
+
+    Every entry is the offset of the first timestamped line found at least `interval_bytes` after the previous
+    entry, together with that line's timestamp key. Updating only reads one short run of lines per entry, so
+    it costs O(entries) whatever the size of the log, and it resumes where the previous update stopped.
+    Rotation and truncation are detected through the inode, the size and a hash of the head of the file;
+    the index is then rebuilt from scratch.
+    """
+    VERSION = 1
+    INDEX_SUFFIX = ".idx"
+    HEAD_BYTES = 4096
+    DEFAULT_INTERVAL_BYTES = 8 * 1024 * 1024
+    # how many lines to look at after a checkpoint for a timestamped one before giving up on that checkpoint
+    MAX_PROBE_LINES = 1000
+
+    def __init__(self, log_file: str, interval_bytes: int = DEFAULT_INTERVAL_BYTES, index_file: str = None):
+        self.log_file = log_file
+        self.index_file = index_file or f"{log_file}{self.INDEX_SUFFIX}"
+        self.interval_bytes = interval_bytes
+        self.inode = None
+        self.head_hash = None
+        self.indexed_size = 0
+        self.offsets = []
+        self.keys = []
+        self.load()
+
+    def reset(self):
+        self.inode = None
+        self.head_hash = None
+        self.indexed_size = 0
+        self.offsets = []
+        self.keys = []
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.VERSION or data.get("interval_bytes") != self.interval_bytes:
+            return
+        self.inode = data["inode"]
+        self.head_hash = data["head_hash"]
+        self.indexed_size = data["indexed_size"]
+        self.offsets = [entry[0] for entry in data["entries"]]
+        self.keys = [entry[1] for entry in data["entries"]]
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "interval_bytes": self.interval_bytes,
+            "inode": self.inode,
+            "head_hash": self.head_hash,
+            "indexed_size": self.indexed_size,
+            "entries": [[offset, key] for offset, key in zip(self.offsets, self.keys)],
+        }
+        temp_file = f"{self.index_file}.tmp"
+        try:
+            with open(temp_file, 'w') as f:
+                json.dump(data, f)
+            os.replace(temp_file, self.index_file)
+        except OSError as e:
+            # the index is only an accelerator, an unwritable log directory must not break the report
+            logger.warning(f"{self.__class__.__name__} could not save {self.index_file}: {e}")
+
+    def _head_hash(self, f) -> str:
+        f.seek(0)
+        return hashlib.sha1(f.read(self.HEAD_BYTES)).hexdigest()
+
+    def _probe(self, f, offset: int) -> (Optional[int], Optional[str]):
+        """
+        Find the first timestamped line starting after offset.
+        :return: (line offset, timestamp key); (None, None) at EOF, (offset to go on from, None) if no
+                 timestamped line was found within MAX_PROBE_LINES
+        """
+        f.seek(offset)
+        if offset:
+            # offset may be in the middle of a line, skip to the start of the next one
+            f.readline()
+        for _ in range(self.MAX_PROBE_LINES):
+            line_offset = f.tell()
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                # EOF or a partially written last line, which is indexed on the next update
+                return None, None
+            key = get_timestamp_key(line.decode('utf-8', errors='replace'))
+            if key is not None:
+                return line_offset, key
+        return f.tell(), None
+
+    def update(self) -> bool:
+        """
+        Index the part of the log written since the last update.
+        :return: whether the log could be read
+        """
+        try:
+            stat = os.stat(self.log_file)
+            with open(self.log_file, 'rb') as f:
+                head_hash = self._head_hash(f)
+                # the head hash only covers HEAD_BYTES, compare it once the file is at least that large
+                head_changed = self.head_hash is not None and self.indexed_size >= self.HEAD_BYTES \
+                    and head_hash != self.head_hash
+                if stat.st_ino != self.inode or stat.st_size < self.indexed_size or head_changed:
+                    if self.inode is not None:
+                        logger.info(f"{self.log_file} was rotated or truncated, rebuilding its offset index.")
+                    self.reset()
+                    self.inode = stat.st_ino
+
+                changed = stat.st_size != self.indexed_size or head_hash != self.head_hash
+                self.head_hash = head_hash
+                next_checkpoint = self.offsets[-1] + self.interval_bytes if self.offsets else 0
+                while next_checkpoint < stat.st_size:
+                    line_offset, key = self._probe(f, next_checkpoint)
+                    if line_offset is None:
+                        break
+                    if key is None:
+                        next_checkpoint = line_offset
+                        continue
+                    if not self.keys or key >= self.keys[-1]:
+                        self.offsets.append(line_offset)
+                        self.keys.append(key)
+                    next_checkpoint = line_offset + self.interval_bytes
+                self.indexed_size = stat.st_size
+        except OSError as e:
+            logger.error(f"{self.__class__.__name__} failed to index {self.log_file}: {e}")
+            return False
+
+        if changed:
+            self.save()
+        return True
+
+    def find_offset(self, start_time: str) -> int:
+        """
+        :param start_time: '%Y-%m-%d %H:%M:%S'
+        :return: an offset at or before the first line logged at or after start_time
+        """
+        # entries with key == start_time may be preceded by more lines of the same second
+        position = bisect.bisect_left(self.keys, start_time)
+        if position == 0:
+            return 0
+        return self.offsets[position - 1]
+
+
+def find_window_offset(log_file: str, start_time: str) -> int:
+    """
+    Bring the sidecar index of log_file up to date and return the offset to start scanning for start_time.
+    Compressed segments cannot be seeked and always start at 0.
+    """
+    if log_file.endswith(GZIP_SUFFIX):
+        return 0
+    index = LogOffsetIndex(log_file)
+    if not index.update():
+        return 0
+    return index.find_offset(start_time)
+
+
+def open_log_segment(log_file: str):
+    """Open a log segment for binary reading, decompressing '.gz' segments on the fly."""
+    if log_file.endswith(GZIP_SUFFIX):
+        return gzip.open(log_file, 'rb')
+    return open(log_file, 'rb')
+
+
+def get_first_timestamp_key(log_file: str, max_lines: int = LogOffsetIndex.MAX_PROBE_LINES) -> Optional[str]:
+    """:return: the timestamp key of the first timestamped line of a log segment, None if there is none"""
+    try:
+        with open_log_segment(log_file) as f:
+            for _ in range(max_lines):
+                line = f.readline()
+                if not line:
+                    break
+                key = get_timestamp_key(line.decode('utf-8', errors='replace'))
+                if key is not None:
+                    return key
+    except (OSError, EOFError) as e:
+        logger.error(f"get_first_timestamp_key failed to read {log_file}: {e}")
+    return None
+
+
+def discover_log_segments(log_file: str, start_time: str = None, end_time: str = None) -> list:
+    """
+    Find the segments of a rotated log, e.g. prod.log.2.gz, prod.log.1 and prod.log, oldest first.
+
+    A segment ends where the next one starts, so when start_time and end_time are given only the segments
+    whose [first timestamp, first timestamp of the next segment] range overlaps the window are returned.
+    """
+    directory, base_name = os.path.split(os.path.abspath(log_file))
+    try:
+        rotated = [os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.startswith(f"{base_name}.") and not name.endswith(NON_SEGMENT_SUFFIXES)]
+    except OSError as e:
+        logger.error(f"discover_log_segments failed to list {directory}: {e}")
+        rotated = []
+    # rotation renames without touching the content, so the modification time orders the segments
+    segments = sorted(rotated, key=lambda path: (os.path.getmtime(path), path))
+    if os.path.exists(log_file):
+        segments.append(os.path.abspath(log_file))
+    if start_time is None or end_time is None:
+        return segments
+
+    first_keys = [get_first_timestamp_key(segment) for segment in segments]
+    overlapping = []
+    for position, segment in enumerate(segments):
+        first_key = first_keys[position]
+        if first_key is None or first_key > end_time:
+            continue
+        next_first_key = next((key for key in first_keys[position + 1:] if key is not None), None)
+        if next_first_key is None or next_first_key >= start_time:
+            overlapping.append(segment)
+    return overlapping
+
+
+def iter_logs_between_start_end(log_file: str, start_time: str, end_time: str,
+                                start_offset: int = 0) -> Iterator[str]:
+    """
+    Stream the lines of log_file whose timestamp lies in [start_time, end_time].
+
+    start_time and end_time use the '%Y-%m-%d %H:%M:%S' format. Unlike `sed -n '/start/,/end/p'` the window
+    does not need a line logged at exactly start_time: it opens at the first line at or after start_time.
+    It closes after the last line of the end_time second, and reading stops there instead of going on to EOF.
+    Lines without a timestamp belong to the window of the line before them.
+
+    :param log_file: path of the log file, gzip compressed if it ends with '.gz'
+    :param start_time: first second of the window
+    :param end_time: last second of the window
+    :param start_offset: byte offset of a line start to begin reading at, see find_window_offset (plain files only)
+    :return: a generator of lines without the trailing newline
+    """
+    in_window = False
+    try:
+        with open_log_segment(log_file) as raw:
+            if start_offset:
+                raw.seek(start_offset)
+            f = io.TextIOWrapper(raw, encoding='utf-8', errors='replace')
+            for line in f:
+                key = get_timestamp_key(line)
+                if key is not None:
+                    if key > end_time:
+                        return
+                    in_window = in_window or key >= start_time
+                if in_window:
+                    yield line.rstrip('\n')
+    except (OSError, EOFError) as e:
+        logger.error(f"iter_logs_between_start_end failed to read {log_file}: {e}")
+
+
+class LogTailer(object):
+    """
+    Incrementally read the lines appended to a log file, like `tail -F`.
+
+    The file handle stays open between reads so that lines written just before a rotation are still read from
+    the rotated file before switching to the new one. A file that shrinks below the current offset
+    (copytruncate) is read again from the start. Only complete lines are returned.
+    """
+
+    def __init__(self, log_file: str, start_offset: int = 0):
+        self.log_file = log_file
+        self.offset = start_offset
+        self._file = None
+        self._pending = b''
+
+    def _open(self) -> bool:
+        try:
+            self._file = open(self.log_file, 'rb')
+        except OSError:
+            self._file = None
+            return False
+        self._file.seek(self.offset)
+        return True
+
+    def _read_available(self) -> list:
+        data = self._file.read()
+        if not data:
+            return []
+        self.offset += len(data)
+        data = self._pending + data
+        last_newline = data.rfind(b'\n')
+        if last_newline < 0:
+            self._pending = data
+            return []
+        self._pending = data[last_newline + 1:]
+        return data[:last_newline].decode('utf-8', errors='replace').split('\n')
+
+    def read_lines(self) -> list:
+        """:return: the complete lines appended since the previous call, without the trailing newline"""
+        if self._file is None and not self._open():
+            return []
+
+        lines = self._read_available()
+        try:
+            stat = os.stat(self.log_file)
+        except OSError:
+            # rotated away and not recreated yet, keep reading the old file
+            return lines
+
+        if stat.st_ino != os.fstat(self._file.fileno()).st_ino:
+            logger.info(f"{self.log_file} was rotated, following the new file.")
+            lines.extend(self._read_available())
+            if self._pending:
+                lines.append(self._pending.decode('utf-8', errors='replace'))
+            self.close()
+            self.offset = 0
+            self._pending = b''
+            if self._open():
+                lines.extend(self._read_available())
+        elif stat.st_size < self.offset:
+            logger.info(f"{self.log_file} was truncated, following it from the start.")
+            self.offset = 0
+            self._pending = b''
+            self._file.seek(0)
+            lines.extend(self._read_available())
+        return lines
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
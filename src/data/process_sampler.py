@@ -0,0 +1,135 @@
+# coding: utf-8
+
+import time
+
+import psutil
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+
+class ProcessSampler(object):
+    """
+    Sample the resource usage of the production processes, found by a part of their command line.
+
+    psutil.Process handles are cached between samples. A process that dies is resolved again through
+    psutil.process_iter, at most every RESOLVE_INTERVAL seconds because listing all processes is expensive.
+    Every sample holds, per process:
+        cpu_percent: CPU usage normalized to the cores of its affinity mask, 100 means all of them are busy
+        rss_mb: resident memory
+        num_threads: thread count
+        ctx_switches: voluntary + involuntary context switches per second
+        io_read_speed, io_write_speed: I/O in MB/s
+    Values are 0 while the process is not running.
+    """
+    METRICS = ("cpu_percent", "rss_mb", "num_threads", "ctx_switches", "io_read_speed", "io_write_speed")
+    RESOLVE_INTERVAL = 5.0
+
+    def __init__(self, processes: dict):
+        """:param processes: {process name: part of its command line}"""
+        self.processes = processes
+        self._handles = {name: None for name in processes}
+        self._core_count = {name: 1 for name in processes}
+        self._last_counters = {name: None for name in processes}
+        self._last_resolve_time = None
+
+    def __getstate__(self):
+        # the psutil handles are resolved again in the process the sampler is copied to, e.g. the sampler agent
+        state = self.__dict__.copy()
+        state["_handles"] = {name: None for name in self.processes}
+        state["_last_counters"] = {name: None for name in self.processes}
+        state["_last_resolve_time"] = None
+        return state
+
+    @staticmethod
+    def column_prefix(name: str) -> str:
+        return name.replace(' ', '_')
+
+    def columns(self) -> list:
+        return [f"{self.column_prefix(name)}_{metric}" for name in self.processes for metric in self.METRICS]
+
+    def _resolve(self):
+        missing = {name: cmdline_part for name, cmdline_part in self.processes.items() if self._handles[name] is None}
+        now = time.monotonic()
+        if not missing or (self._last_resolve_time is not None
+                           and now - self._last_resolve_time < self.RESOLVE_INTERVAL):
+            return
+        self._last_resolve_time = now
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                if proc.info['name'] != 'python3' or not proc.info['cmdline']:
+                    continue
+                for name, cmdline_part in list(missing.items()):
+                    if any(cmdline_part in cmd for cmd in proc.info['cmdline']):
+                        self._attach(name, proc)
+                        del missing[name]
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+            if not missing:
+                break
+
+    def _attach(self, name: str, proc: psutil.Process):
+        try:
+            self._core_count[name] = len(proc.cpu_affinity()) or 1
+        except (AttributeError, psutil.Error):
+            # cpu_affinity is not available on every platform
+            self._core_count[name] = psutil.cpu_count() or 1
+        # the first cpu_percent call only sets the reference point
+        proc.cpu_percent(None)
+        self._handles[name] = proc
+        self._last_counters[name] = None
+
+    def pid(self, name: str):
+        """:return: the pid of a process, None while it is not running"""
+        self._resolve()
+        proc = self._handles[name]
+        return proc.pid if proc is not None else None
+
+    def affinity(self, name: str) -> list:
+        self._resolve()
+        proc = self._handles[name]
+        try:
+            return proc.cpu_affinity() if proc is not None else []
+        except (AttributeError, psutil.Error):
+            return []
+
+    def sample(self) -> list:
+        """:return: the values of self.columns()"""
+        self._resolve()
+        values = []
+        for name in self.processes:
+            values += self._sample_process(name)
+        return values
+
+    def _sample_process(self, name: str) -> list:
+        proc = self._handles[name]
+        if proc is None:
+            return [0] * len(self.METRICS)
+        try:
+            with proc.oneshot():
+                now = time.monotonic()
+                cpu_percent = proc.cpu_percent(None) / self._core_count[name]
+                rss_mb = proc.memory_info().rss / (1024 * 1024)
+                num_threads = proc.num_threads()
+                ctx_switches = sum(proc.num_ctx_switches())
+                try:
+                    io_counters = proc.io_counters()
+                    read_bytes, write_bytes = io_counters.read_bytes, io_counters.write_bytes
+                except (AttributeError, psutil.AccessDenied):
+                    read_bytes, write_bytes = 0, 0
+        except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+            logger.warning(f"{self.__class__.__name__} lost process {name} (pid {proc.pid}), resolving it again.")
+            self._handles[name] = None
+            self._last_resolve_time = None
+            return [0] * len(self.METRICS)
+
+        last_counters = self._last_counters[name]
+        self._last_counters[name] = (now, ctx_switches, read_bytes, write_bytes)
+        if last_counters is None:
+            return [cpu_percent, rss_mb, num_threads, 0, 0, 0]
+        elapsed = max(now - last_counters[0], 1e-6)
+        return [cpu_percent, rss_mb, num_threads,
+                (ctx_switches - last_counters[1]) / elapsed,
+                (read_bytes - last_counters[2]) / elapsed / (1024 * 1024),
+                (write_bytes - last_counters[3]) / elapsed / (1024 * 1024)]
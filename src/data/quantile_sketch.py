@@ -0,0 +1,155 @@
+# coding: utf-8
+
+import math
+from typing import Iterable
+
+
+class DDSketch(object):
+    """
+    Mergeable quantile sketch with bounded memory and relative error guarantees (DDSketch).
+
+    Values are counted in logarithmic buckets [gamma ** (k - 1), gamma ** k) with
+    gamma = (1 + relative_accuracy) / (1 - relative_accuracy), so every quantile is returned within
+    relative_accuracy of the true sample. When there are more than max_bins buckets the lowest ones are
+    collapsed, which keeps the tail latencies exact to relative_accuracy. Two sketches with the same
+    relative_accuracy merge by adding their bucket counts, so per-run and per-IPC sketches can be combined
+    without the raw samples.
+    """
+    DEFAULT_RELATIVE_ACCURACY = 0.01
+    DEFAULT_MAX_BINS = 2048
+    # values with a smaller magnitude are counted as 0
+    MIN_INDEXABLE_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_bins: int = DEFAULT_MAX_BINS):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy {relative_accuracy} must be between 0 and 1.")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.negative_bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        # the point of the bucket with the same relative distance to both bounds
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def _collapse(self, bins: dict):
+        keys = sorted(bins)
+        collapse_count = len(keys) - self.max_bins
+        lowest_kept = keys[collapse_count]
+        for key in keys[:collapse_count]:
+            bins[lowest_kept] += bins.pop(key)
+
+    def add(self, value: float, weight: int = 1):
+        if value > self.MIN_INDEXABLE_VALUE:
+            key = self._key(value)
+            self.bins[key] = self.bins.get(key, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse(self.bins)
+        elif value < -self.MIN_INDEXABLE_VALUE:
+            key = self._key(-value)
+            self.negative_bins[key] = self.negative_bins.get(key, 0) + weight
+            if len(self.negative_bins) > self.max_bins:
+                self._collapse(self.negative_bins)
+        else:
+            self.zero_count += weight
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "DDSketch"):
+        if other.gamma != self.gamma:
+            raise ValueError(f"Cannot merge sketches with relative accuracy {other.relative_accuracy} "
+                             f"and {self.relative_accuracy}.")
+        for bins, other_bins in ((self.bins, other.bins), (self.negative_bins, other.negative_bins)):
+            for key, count in other_bins.items():
+                bins[key] = bins.get(key, 0) + count
+            if len(bins) > self.max_bins:
+                self._collapse(bins)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q: float) -> float:
+        """:return: the q quantile (0 <= q <= 1), 0 for an empty sketch"""
+        if not self.count:
+            return 0
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative_bins, reverse=True):
+            seen += self.negative_bins[key]
+            if seen > rank:
+                return max(-self._value(key), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return min(self._value(key), self.max)
+        return self.max
+
+    def percentiles(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> list:
+        """:return: [p50, p95, p99] by default"""
+        return [self.quantile(q) for q in quantiles]
+
+    def histogram(self) -> list:
+        """:return: [[lower bound, upper bound, count], ...] in ascending order of the values"""
+        histogram = [[-self.gamma ** key, -self.gamma ** (key - 1), self.negative_bins[key]]
+                     for key in sorted(self.negative_bins, reverse=True)]
+        if self.zero_count:
+            histogram.append([0, 0, self.zero_count])
+        histogram.extend([self.gamma ** (key - 1), self.gamma ** key, self.bins[key]] for key in sorted(self.bins))
+        return histogram
+
+    def to_dict(self) -> dict:
+        """JSON serializable state, see from_dict"""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_bins": self.max_bins,
+            "bins": {str(key): count for key, count in self.bins.items()},
+            "negative_bins": {str(key): count for key, count in self.negative_bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DDSketch":
+        sketch = cls(data["relative_accuracy"], data["max_bins"])
+        sketch.bins = {int(key): count for key, count in data["bins"].items()}
+        sketch.negative_bins = {int(key): count for key, count in data["negative_bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+def merge_sketch_dicts(sketch_dicts: Iterable[dict]) -> DDSketch:
+    """
+    Merge serialized sketches, e.g. the latency_sketches of several runs or IPCs.
+    :param sketch_dicts: DDSketch.to_dict() results
+    """
+    merged = None
+    for sketch_dict in sketch_dicts:
+        sketch = DDSketch.from_dict(sketch_dict)
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged if merged is not None else DDSketch()
@@ -0,0 +1,250 @@
+# coding: utf-8
+
+import json
+import os
+import re
+import shutil
+from itertools import zip_longest
+from typing import Iterator, Sequence
+
+from log import formatted_logging
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+
+def get_cell_width(value) -> int:
+    """:return: the column width that shows the longest line of value"""
+    if value is None:
+        return 0
+    return max(len(line) for line in str(value).split('\n')) + 2
+
+
+class ReportStore(object):
+    """
+    Append-only store of the benchmark report, the xlsx is generated from it on demand.
+
+    A directory holds:
+        rows.jsonl: one JSON list per run, in the order of the header
+        columns.json: the header, the width of every column and the order of the chart sheets
+        charts/<sheet title>/: the images of every chart sheet, with images.json listing (file, top left cell),
+                               and series.json with the samples of its native charts
+    Adding a run appends one line and updates the column widths from that row only, so its cost does not depend
+    on the number of runs before it. write_xlsx streams the rows into an openpyxl write-only workbook. The samples
+    of the native charts of a chart sheet are written to a hidden sheet, so the curves can be zoomed and copied
+    into the charts of other runs in Excel. openpyxl is only imported to write or import a workbook.
+    """
+    ROWS_FILE_NAME = "rows.jsonl"
+    COLUMNS_FILE_NAME = "columns.json"
+    CHARTS_DIRECTORY_NAME = "charts"
+    IMAGES_FILE_NAME = "images.json"
+    SERIES_FILE_NAME = "series.json"
+    # hidden sheet of the samples of the n-th chart sheet
+    SERIES_SHEET_TITLE = "series_{}"
+    # size of a native chart in cm, about the size of the chart images
+    CHART_WIDTH = 36.8
+    CHART_HEIGHT = 15.2
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.rows_path = os.path.join(directory, self.ROWS_FILE_NAME)
+        self.columns_path = os.path.join(directory, self.COLUMNS_FILE_NAME)
+        self.charts_directory = os.path.join(directory, self.CHARTS_DIRECTORY_NAME)
+        os.makedirs(self.charts_directory, exist_ok=True)
+        self.columns = self.load_columns()
+
+    def load_columns(self) -> dict:
+        try:
+            with open(self.columns_path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"header": [], "widths": [], "chart_sheets": []}
+
+    def save_columns(self):
+        tmp_path = f"{self.columns_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.columns, f, ensure_ascii=False)
+        os.replace(tmp_path, self.columns_path)
+
+    def is_empty(self) -> bool:
+        return not os.path.exists(self.rows_path) and not self.columns["chart_sheets"]
+
+    def update_widths(self, row: Sequence):
+        widths = self.columns["widths"]
+        for index, value in enumerate(row):
+            if index >= len(widths):
+                widths.append(0)
+            widths[index] = max(widths[index], get_cell_width(value))
+
+    def set_header(self, header: Sequence[str]):
+        """Columns added to the header of existing reports are appended, the stored rows are left as they are."""
+        if list(header) != self.columns["header"]:
+            self.columns["header"] = list(header)
+            self.update_widths(header)
+            self.save_columns()
+
+    def append_row(self, row: Sequence):
+        with open(self.rows_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(list(row), ensure_ascii=False, default=str) + '\n')
+        self.update_widths(row)
+        self.save_columns()
+
+    def rows(self) -> Iterator[list]:
+        try:
+            with open(self.rows_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def chart_sheet_directory(self, title: str) -> str:
+        return os.path.join(self.charts_directory, re.sub(r'[\\/*?:"<>|\[\]]', "_", title))
+
+    def set_chart_sheet(self, title: str, images: Sequence, series: dict = None, charts: Sequence = ()):
+        """
+        Replace a chart sheet, it is moved after all the others like a recreated worksheet.
+        :param images: [(PNG file path or PNG bytes, top left cell), ...]
+        :param series: {series name: (x values, y values)} of the native charts
+        :param charts: [(series name, chart title, x axis title, top left cell), ...], one native line chart each
+        """
+        directory = self.chart_sheet_directory(title)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        image_cells = []
+        for index, (image, cell) in enumerate(images):
+            file_name = f"{index}.png"
+            if isinstance(image, (bytes, bytearray)):
+                with open(os.path.join(directory, file_name), 'wb') as f:
+                    f.write(image)
+            else:
+                shutil.copyfile(image, os.path.join(directory, file_name))
+            image_cells.append([file_name, cell])
+        with open(os.path.join(directory, self.IMAGES_FILE_NAME), 'w') as f:
+            json.dump(image_cells, f)
+        if series:
+            with open(os.path.join(directory, self.SERIES_FILE_NAME), 'w') as f:
+                json.dump({"series": {name: [list(map(float, x)), list(map(float, y))]
+                                      for name, (x, y) in series.items()},
+                           "charts": [list(chart) for chart in charts]}, f)
+
+        chart_sheets = self.columns["chart_sheets"]
+        if title in chart_sheets:
+            chart_sheets.remove(title)
+        chart_sheets.append(title)
+        self.save_columns()
+
+    def chart_sheet_images(self, title: str) -> list:
+        """:return: [(PNG file path, top left cell), ...]"""
+        directory = self.chart_sheet_directory(title)
+        try:
+            with open(os.path.join(directory, self.IMAGES_FILE_NAME), 'r') as f:
+                return [(os.path.join(directory, file_name), cell) for file_name, cell in json.load(f)]
+        except FileNotFoundError:
+            return []
+
+    def chart_sheet_series(self, title: str) -> dict:
+        """:return: {"series": {series name: [x values, y values]}, "charts": [...]}, see set_chart_sheet"""
+        try:
+            with open(os.path.join(self.chart_sheet_directory(title), self.SERIES_FILE_NAME), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"series": {}, "charts": []}
+
+    def write_series_sheet(self, wb, title: str, series: dict) -> dict:
+        """
+        Write the series of a chart sheet into a hidden sheet, two columns per series: x and y.
+        :return: {series name: (x Reference, y Reference with the series name as title)}
+        """
+        from openpyxl.chart import Reference
+
+        series_ws = wb.create_sheet(title=title)
+        series_ws.sheet_state = "hidden"
+        header = []
+        columns = []
+        for name, (x, y) in series.items():
+            header += [f"{name} x", name]
+            columns += [x, y]
+        series_ws.append(header)
+        for row in zip_longest(*columns):
+            series_ws.append(row)
+        references = {}
+        for index, (name, (x, y)) in enumerate(series.items()):
+            references[name] = (Reference(series_ws, min_col=2 * index + 1, min_row=2, max_row=len(x) + 1),
+                                Reference(series_ws, min_col=2 * index + 2, min_row=1, max_row=len(y) + 1))
+        return references
+
+    def create_line_chart(self, x_reference, y_reference, title: str, x_title: str):
+        from openpyxl.chart import ScatterChart, Series
+
+        # a scatter chart with lines, the x axis of a LineChart has one category per sample
+        chart = ScatterChart()
+        chart.title = title
+        chart.x_axis.title = x_title
+        chart.y_axis.title = title
+        chart.legend = None
+        chart.width = self.CHART_WIDTH
+        chart.height = self.CHART_HEIGHT
+        series = Series(y_reference, x_reference, title_from_data=True)
+        series.marker.symbol = "none"
+        series.smooth = False
+        chart.series.append(series)
+        return chart
+
+    def write_xlsx(self, xlsx_path: str, data_sheet_title: str = "data"):
+        """Generate the report workbook, the rows are streamed and never held in memory together."""
+        from openpyxl import Workbook
+        from openpyxl.drawing.image import Image
+        from openpyxl.utils import get_column_letter
+
+        wb = Workbook(write_only=True)
+        data_ws = wb.create_sheet(title=data_sheet_title)
+        # column widths have to be set before the first row of a write-only worksheet
+        for index, width in enumerate(self.columns["widths"]):
+            data_ws.column_dimensions[get_column_letter(index + 1)].width = width
+        data_ws.append(self.columns["header"])
+        for row in self.rows():
+            data_ws.append(row)
+
+        for index, title in enumerate(self.columns["chart_sheets"]):
+            chart_ws = wb.create_sheet(title=title)
+            for image_path, cell in self.chart_sheet_images(title):
+                img = Image(image_path)
+                img.anchor = cell
+                chart_ws.add_image(img)
+            chart_sheet_series = self.chart_sheet_series(title)
+            if chart_sheet_series["series"]:
+                references = self.write_series_sheet(wb, self.SERIES_SHEET_TITLE.format(index),
+                                                     chart_sheet_series["series"])
+                for name, chart_title, x_title, cell in chart_sheet_series["charts"]:
+                    x_reference, y_reference = references[name]
+                    chart_ws.add_chart(self.create_line_chart(x_reference, y_reference, chart_title, x_title), cell)
+
+        tmp_path = f"{xlsx_path}.tmp"
+        wb.save(tmp_path)
+        os.replace(tmp_path, xlsx_path)
+
+    def import_xlsx(self, xlsx_path: str, data_sheet_title: str = "data"):
+        """Import a report created before the store existed: its rows and the images of its chart sheets."""
+        from openpyxl import load_workbook
+        from openpyxl.utils import get_column_letter
+
+        wb = load_workbook(xlsx_path)
+        if data_sheet_title in wb.sheetnames:
+            rows = wb[data_sheet_title].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is not None:
+                self.set_header([value for value in header if value is not None])
+            with open(self.rows_path, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(list(row), ensure_ascii=False, default=str) + '\n')
+                    self.update_widths(row)
+            self.save_columns()
+        for ws in wb.worksheets:
+            if ws.title == data_sheet_title or ws.sheet_state != "visible" or not ws._images:
+                continue
+            images = []
+            for img in ws._images:
+                anchor = img.anchor._from
+                images.append((img._data(), f"{get_column_letter(anchor.col + 1)}{anchor.row + 1}"))
+            self.set_chart_sheet(ws.title, images)
+        logger.info(f"{self.__class__.__name__} imported {xlsx_path} into {self.directory}.")
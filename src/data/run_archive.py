@@ -0,0 +1,112 @@
+# coding: utf-8
+
+import json
+import os
+from typing import Dict
+
+import numpy as np
+
+from log import formatted_logging
+from src.data.time_series import TimeSeriesStore
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+
+class RunArchive(object):
+    """
+    Columnar archive of one benchmark run: the sampled system data and the parsed log events.
+
+    A run is a directory with:
+        manifest.json: format version, run metadata and the names of the columns
+        samples.npz / samples/<column>.npy: the timestamp and every system data column, float64
+        events.npz / events/<metric>.<column>.npy: the event columns of every log metric, e.g. the stage
+                                                   timestamps of every part of the part_timeline
+    Compressed archives are zipped .npz files, whose columns are only decompressed when they are read.
+    Uncompressed archives keep one .npy file per column, which is memory-mapped when it is read. Either way a
+    later analysis only reads the columns it needs.
+    """
+    FORMAT_VERSION = 1
+    MANIFEST_FILE_NAME = "manifest.json"
+    TIMESTAMP_COLUMN = "timestamp"
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        with open(os.path.join(self.path, self.MANIFEST_FILE_NAME), 'r') as f:
+            self.manifest = json.load(f)
+        self._npz_files = {}
+
+    @classmethod
+    def write(cls, path, system_data: TimeSeriesStore, events: Dict[str, dict], metadata: dict = None,
+              compressed: bool = True) -> "RunArchive":
+        """
+        :param events: {metric name: {column name: sequence}}, see LogAnalyzer.events
+        :param metadata: JSON serializable description of the run, e.g. the benchmark config
+        """
+        path = str(path)
+        os.makedirs(path, exist_ok=True)
+        samples = {cls.TIMESTAMP_COLUMN: system_data.timestamps()}
+        samples.update((column, system_data.column(column)) for column in system_data.columns)
+        event_columns = {f"{metric}.{column}": np.asarray(values)
+                         for metric, metric_events in events.items() for column, values in metric_events.items()}
+        cls._write_columns(path, "samples", samples, compressed)
+        cls._write_columns(path, "events", event_columns, compressed)
+
+        manifest = {
+            "version": cls.FORMAT_VERSION,
+            "compressed": compressed,
+            "sample_count": len(system_data),
+            "sample_columns": list(samples),
+            "event_columns": list(event_columns),
+            "metadata": metadata or {},
+        }
+        tmp_path = os.path.join(path, f"{cls.MANIFEST_FILE_NAME}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, ensure_ascii=False, default=str)
+        # written last, an archive without manifest is incomplete
+        os.replace(tmp_path, os.path.join(path, cls.MANIFEST_FILE_NAME))
+        return cls(path)
+
+    @staticmethod
+    def _write_columns(path: str, name: str, columns: Dict[str, np.ndarray], compressed: bool):
+        if compressed:
+            np.savez_compressed(os.path.join(path, f"{name}.npz"), **columns)
+            return
+        directory = os.path.join(path, name)
+        os.makedirs(directory, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(directory, f"{column}.npy"), values)
+
+    def _read_column(self, name: str, column: str) -> np.ndarray:
+        if self.manifest["compressed"]:
+            if name not in self._npz_files:
+                self._npz_files[name] = np.load(os.path.join(self.path, f"{name}.npz"))
+            return self._npz_files[name][column]
+        return np.load(os.path.join(self.path, name, f"{column}.npy"), mmap_mode='r')
+
+    @property
+    def metadata(self) -> dict:
+        return self.manifest["metadata"]
+
+    def sample_columns(self) -> list:
+        return self.manifest["sample_columns"]
+
+    def event_columns(self) -> list:
+        """:return: ["<metric>.<column>", ...]"""
+        return self.manifest["event_columns"]
+
+    def samples(self, column: str) -> np.ndarray:
+        """:param column: a system data column or "timestamp" """
+        if column not in self.manifest["sample_columns"]:
+            raise KeyError(f"{self.path} has no sample column {column}.")
+        return self._read_column("samples", column)
+
+    def events(self, metric: str, column: str) -> np.ndarray:
+        name = f"{metric}.{column}"
+        if name not in self.manifest["event_columns"]:
+            raise KeyError(f"{self.path} has no event column {name}.")
+        return self._read_column("events", name)
+
+    def close(self):
+        for npz_file in self._npz_files.values():
+            npz_file.close()
+        self._npz_files.clear()
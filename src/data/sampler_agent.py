@@ -0,0 +1,147 @@
+# coding: utf-8
+
+import os
+import multiprocessing
+from threading import Thread
+from typing import Callable, Sequence
+
+import psutil
+
+from log import formatted_logging
+from src.data.system_sampler import SystemSampler
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+STOP_MESSAGE = "stop"
+STARTED_MESSAGE = "started"
+STOPPED_MESSAGE = "stopped"
+
+
+def run_sampler_agent(connection, system_sampler: SystemSampler, interval: float, cores: Sequence[int] = None):
+    """
+    Entry point of the sampler agent process: sample until the controller sends STOP_MESSAGE.
+    The first message is (STARTED_MESSAGE, pid), every sample is then sent as (wall clock time, values), the last
+    message is (STOPPED_MESSAGE, missed ticks).
+    :param cores: CPU cores the agent is pinned to, keep them apart from the production processes
+    """
+    if cores:
+        try:
+            psutil.Process().cpu_affinity(list(cores))
+        except (AttributeError, psutil.Error, ValueError) as e:
+            logger.error(f"{run_sampler_agent.__name__} failed to pin the sampler agent to cores {cores}: {e}")
+
+    def send_sample(sample_time, values):
+        connection.send((sample_time, values))
+
+    missed_ticks = 0
+    try:
+        connection.send((STARTED_MESSAGE, os.getpid()))
+        missed_ticks = system_sampler.sample_until(interval, send_sample, connection.poll)
+    except (BrokenPipeError, EOFError):
+        # the controller is gone, nobody is left to receive the samples
+        return
+    finally:
+        system_sampler.gpu_provider.shutdown()
+    connection.send((STOPPED_MESSAGE, missed_ticks))
+    connection.close()
+
+
+class SamplerAgent(object):
+    """
+    Run a SystemSampler in its own process, so the monitoring neither competes for the GIL of the benchmark
+    driver nor runs on the cores of the production processes.
+
+    Samples are streamed back over a multiprocessing pipe and passed to on_sample(wall clock time, values) by a
+    receiver thread of the controller. The agent samples its own CPU and memory usage, see
+    SystemSampler.MONITOR_COLUMNS.
+
+    The agent is spawned, not forked: the controller runs threads (log follower, inventory collectors, the
+    receiver) whose locks a fork would copy while they are held, and an initialized NVML handle must not be
+    shared with a child. The spawned agent unpickles the sampler and initializes NVML itself.
+
+    Spawning re-imports the __main__ module of the driver in the agent, so the driver script has to start the
+    benchmark under `if __name__ == "__main__":`. Without the guard the agent exits at start-up, `start` raises
+    a RuntimeError then, as does `check` when the agent exits before `stop`, instead of reporting no samples.
+    """
+    START_METHOD = "spawn"
+    # seconds the agent has to import its modules and report STARTED_MESSAGE
+    START_TIMEOUT = 60
+
+    def __init__(self, system_sampler: SystemSampler, interval: float, on_sample: Callable[[float, list], None],
+                 cores: Sequence[int] = None):
+        """
+        :param system_sampler: copied to the agent process, its GPU provider has to be picklable
+        :param cores: CPU cores the agent is pinned to, any core by default
+        """
+        self.system_sampler = system_sampler
+        self.interval = interval
+        self.on_sample = on_sample
+        self.cores = cores
+        self.missed_ticks = 0
+        self.exited_early = False
+        self.process = None
+        self.thread = None
+        self.connection = None
+
+    def start(self):
+        context = multiprocessing.get_context(self.START_METHOD)
+        self.connection, agent_connection = context.Pipe()
+        self.process = context.Process(target=run_sampler_agent, name="sampler_agent", daemon=True,
+                                       args=(agent_connection, self.system_sampler, self.interval, self.cores))
+        self.process.start()
+        # only the agent keeps its end of the pipe open, so that recv fails once the agent is gone
+        agent_connection.close()
+        self.wait_started()
+        self.thread = Thread(target=self.thread_receive, daemon=True)
+        self.thread.start()
+        return self.process
+
+    def wait_started(self):
+        """Wait for STARTED_MESSAGE of the agent, raise RuntimeError when it exits or times out before."""
+        try:
+            if self.connection.poll(self.START_TIMEOUT):
+                message, _ = self.connection.recv()
+                if message == STARTED_MESSAGE:
+                    return
+        except EOFError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+        raise RuntimeError(f"{self.__class__.__name__} did not start (exit code {self.process.exitcode}), is the "
+                           f"benchmark of the driver script started under if __name__ == '__main__'?")
+
+    def check(self):
+        """Raise RuntimeError when the agent exited before it was stopped, its samples are missing then."""
+        if self.exited_early:
+            raise RuntimeError(f"{self.__class__.__name__} exited with code {self.process.exitcode} before it was "
+                               f"stopped, the system data is incomplete.")
+
+    def thread_receive(self):
+        while True:
+            try:
+                sample_time, values = self.connection.recv()
+            except EOFError:
+                self.exited_early = True
+                logger.error(f"{self.__class__.__name__} exited with code {self.process.exitcode} "
+                             f"before it was stopped.")
+                return
+            if sample_time == STOPPED_MESSAGE:
+                self.missed_ticks = values
+                return
+            self.on_sample(sample_time, values)
+
+    def stop(self, timeout: float = 10) -> int:
+        """:return: the number of ticks the agent missed, see SystemSampler.sample_until"""
+        try:
+            self.connection.send(STOP_MESSAGE)
+        except (BrokenPipeError, OSError):
+            pass
+        self.thread.join(timeout)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.error(f"{self.__class__.__name__} did not stop within {timeout}s, terminating it.")
+            self.process.terminate()
+        self.connection.close()
+        return self.missed_ticks
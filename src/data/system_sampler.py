@@ -0,0 +1,203 @@
+# coding: utf-8
+
+import os
+import time
+from typing import Callable
+
+import psutil
+
+from log import formatted_logging
+from src.data.gpu_provider import GpuProvider
+from src.data.process_sampler import ProcessSampler
+
+logger = formatted_logging.FormattedLogging(__name__).getLog()
+
+# virtual block devices, their IO is counted on the disks behind them
+VIRTUAL_DISK_PREFIXES = ("loop", "ram", "zram", "dm-", "md")
+LINUX_BLOCK_DEVICES_PATH = "/sys/block"
+
+
+def get_disk_devices() -> list:
+    """:return: the names of the physical disks in psutil.disk_io_counters(perdisk=True), without partitions"""
+    disk_io = psutil.disk_io_counters(perdisk=True) or {}
+    devices = [device for device in disk_io if not device.startswith(VIRTUAL_DISK_PREFIXES)]
+    if os.path.isdir(LINUX_BLOCK_DEVICES_PATH):
+        # partitions are only listed under the directory of their disk
+        devices = [device for device in devices if os.path.exists(os.path.join(LINUX_BLOCK_DEVICES_PATH, device))]
+    return sorted(devices)
+
+
+def get_network_interfaces() -> list:
+    """:return: the names of the network interfaces but loopback"""
+    net_io = psutil.net_io_counters(pernic=True) or {}
+    return sorted(nic for nic in net_io if nic != "lo" and not nic.lower().startswith("loopback"))
+
+
+def get_existing_path(path) -> str:
+    """:return: path or its closest existing parent, the output folder may only be created by the first part"""
+    path = os.path.abspath(str(path))
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+
+class SystemSampler(object):
+    """
+    Take one sample of the system data: the whole machine, every CPU core, every GPU and the production processes.
+
+    The sampler holds no reference to the controller, so it runs the same in the DataMonitor thread and in the
+    sampler agent process, see src.data.sampler_agent.
+    """
+    # gpu_usage and gpu_mem_usage are averaged over all GPUs, disk_usage is the usage of the output path
+    SYSTEM_DATA_COLUMNS = ("cpu_usage", "gpu_usage", "gpu_mem_usage", "memory_usage", "disk_usage",
+                           "disk_read_speed", "disk_write_speed")
+    # CPU % (100 is one core) and RSS in MB of the process that samples, i.e. the cost of the monitoring itself
+    MONITOR_COLUMNS = ("monitor_cpu_percent", "monitor_rss_mb")
+    # per disk: IO per second, % of the time the disk was busy and average time of an IO in ms
+    DISK_METRICS = ("read_iops", "write_iops", "busy", "await")
+    # per network interface: MB/s and packets dropped since the previous sample
+    NETWORK_METRICS = ("rx_speed", "tx_speed", "drops")
+
+    def __init__(self, gpu_provider: GpuProvider, processes: dict, gpu_processes: tuple, output_path='/'):
+        """
+        :param processes: {process name: part of its command line}, see ProcessSampler
+        :param gpu_processes: names of the processes whose GPU memory is sampled, in MB
+        :param output_path: folder the images are saved in, disk_usage is the usage of its file system
+        """
+        self.gpu_provider = gpu_provider
+        self.process_sampler = ProcessSampler(processes)
+        self.gpu_processes = gpu_processes
+        self.gpu_count = gpu_provider.device_count()
+        self.core_count = psutil.cpu_count() or 1
+        self.output_path = output_path
+        self.disk_devices = get_disk_devices()
+        self.network_interfaces = get_network_interfaces()
+        self._last_disk_io = None
+        self._last_device_io = None
+        self._last_network_io = None
+        self._last_time = None
+
+    def cpu_core_columns(self) -> list:
+        return [f"cpu{core}_usage" for core in range(self.core_count)]
+
+    def columns(self) -> list:
+        columns = list(self.SYSTEM_DATA_COLUMNS)
+        columns += self.cpu_core_columns()
+        for gpu_index in range(self.gpu_count):
+            columns += [f"gpu{gpu_index}_usage", f"gpu{gpu_index}_mem_usage"]
+        columns += [f"{name}_gpu_memory" for name in self.gpu_processes]
+        columns += [f"disk_{device}_{metric}" for device in self.disk_devices for metric in self.DISK_METRICS]
+        columns += [f"nic_{nic}_{metric}" for nic in self.network_interfaces for metric in self.NETWORK_METRICS]
+        columns += self.process_sampler.columns()
+        columns += self.MONITOR_COLUMNS
+        return columns
+
+    def reset(self):
+        self._last_disk_io = psutil.disk_io_counters()
+        self._last_device_io = psutil.disk_io_counters(perdisk=True) or {}
+        self._last_network_io = psutil.net_io_counters(pernic=True) or {}
+        self._last_time = time.monotonic()
+
+    def sample_disk_devices(self, device_io: dict, elapsed: float) -> list:
+        values = []
+        for device in self.disk_devices:
+            current, last = device_io.get(device), self._last_device_io.get(device)
+            if current is None or last is None:
+                values += [0] * len(self.DISK_METRICS)
+                continue
+            reads = current.read_count - last.read_count
+            writes = current.write_count - last.write_count
+            # busy_time is only counted on Linux and FreeBSD
+            busy_ms = getattr(current, "busy_time", 0) - getattr(last, "busy_time", 0)
+            io_ms = (current.read_time - last.read_time) + (current.write_time - last.write_time)
+            values += [reads / elapsed, writes / elapsed, min(busy_ms / (elapsed * 1000) * 100, 100),
+                       io_ms / (reads + writes) if reads + writes else 0]
+        return values
+
+    def sample_network_interfaces(self, network_io: dict, elapsed: float) -> list:
+        values = []
+        for nic in self.network_interfaces:
+            current, last = network_io.get(nic), self._last_network_io.get(nic)
+            if current is None or last is None:
+                values += [0] * len(self.NETWORK_METRICS)
+                continue
+            values += [(current.bytes_recv - last.bytes_recv) / elapsed / (1024 * 1024),
+                       (current.bytes_sent - last.bytes_sent) / elapsed / (1024 * 1024),
+                       (current.dropin - last.dropin) + (current.dropout - last.dropout)]
+        return values
+
+    def sample(self) -> list:
+        """:return: the values of self.columns() but MONITOR_COLUMNS, see sample_until"""
+        if self._last_time is None:
+            self.reset()
+        cpu_core_usage = psutil.cpu_percent(interval=0, percpu=True)
+        cpu_usage = sum(cpu_core_usage) / len(cpu_core_usage) if cpu_core_usage else 0
+
+        gpu_samples = self.gpu_provider.sample()
+        gpu_usage = [gpu.utilization for gpu in gpu_samples]
+        gpu_mem_usage = [(gpu.memory_used / gpu.memory_total) * 100 for gpu in gpu_samples]
+        gpu_process_pids = [self.process_sampler.pid(name) for name in self.gpu_processes]
+        process_gpu_memory = self.gpu_provider.process_memory([pid for pid in gpu_process_pids if pid is not None])
+
+        memory_info = psutil.virtual_memory()
+        disk_info = psutil.disk_usage(get_existing_path(self.output_path))
+
+        current_disk_io = psutil.disk_io_counters()
+        current_device_io = psutil.disk_io_counters(perdisk=True) or {}
+        current_network_io = psutil.net_io_counters(pernic=True) or {}
+        current_time = time.monotonic()
+        # the first sample has no previous counters to compare with
+        elapsed = max(current_time - self._last_time, 1e-6)
+        read_speed = (current_disk_io.read_bytes - self._last_disk_io.read_bytes) / elapsed / (1024 * 1024)
+        write_speed = (current_disk_io.write_bytes - self._last_disk_io.write_bytes) / elapsed / (1024 * 1024)
+        device_values = self.sample_disk_devices(current_device_io, elapsed)
+        network_values = self.sample_network_interfaces(current_network_io, elapsed)
+        self._last_disk_io = current_disk_io
+        self._last_device_io = current_device_io
+        self._last_network_io = current_network_io
+        self._last_time = current_time
+
+        values = [cpu_usage, sum(gpu_usage) / len(gpu_usage) if gpu_usage else 0,
+                  sum(gpu_mem_usage) / len(gpu_mem_usage) if gpu_mem_usage else 0,
+                  memory_info.percent, disk_info.percent, read_speed, write_speed]
+        values += cpu_core_usage[:self.core_count]
+        for device_usage, device_mem_usage in zip(gpu_usage, gpu_mem_usage):
+            values += [device_usage, device_mem_usage]
+        values += [process_gpu_memory.get(pid, 0) / (1024 * 1024) for pid in gpu_process_pids]
+        values += device_values
+        values += network_values
+        values += self.process_sampler.sample()
+        return values
+
+    def sample_until(self, interval: float, append: Callable[[float, list], None],
+                     should_stop: Callable[[], bool]) -> int:
+        """
+        Sample every interval seconds until should_stop() returns True.
+
+        Samples are scheduled against time.monotonic() deadlines, so the cost of the measurements does not
+        stretch the period. Every sample is passed to append(wall clock time, values) together with the CPU and
+        memory usage of the current process. When a sample takes longer than the period, the ticks it overran
+        are skipped instead of being taken late.
+        :return: the number of missed ticks
+        """
+        self.reset()
+        monitor_process = psutil.Process()
+        # the first cpu_percent call only sets the reference point
+        monitor_process.cpu_percent(None)
+        missed_ticks = 0
+        next_deadline = time.monotonic()
+
+        while not should_stop():
+            sample_time = time.time()
+            values = self.sample()
+            values += [monitor_process.cpu_percent(None), monitor_process.memory_info().rss / (1024 * 1024)]
+            append(sample_time, values)
+
+            next_deadline += interval
+            now = time.monotonic()
+            if now > next_deadline:
+                overrun_ticks = int((now - next_deadline) // interval) + 1
+                missed_ticks += overrun_ticks
+                next_deadline += overrun_ticks * interval
+            time.sleep(max(next_deadline - time.monotonic(), 0))
+        return missed_ticks
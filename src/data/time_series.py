@@ -0,0 +1,114 @@
+# coding: utf-8
+
+from array import array
+from threading import Lock
+from typing import Iterable, Sequence
+
+import numpy as np
+
+
+class TimeSeriesStore(object):
+    """
+    Typed, contiguous storage of sampled metrics: one timestamp column plus one float64 column per metric.
+
+    Every column is an array('d'), 8 bytes per sample instead of a list of boxed floats. With a capacity the
+    columns are preallocated ring buffers that keep the most recent `capacity` samples, so multi-day soak tests
+    use bounded memory. Columns are read as NumPy arrays in chronological order, which makes the aggregations
+    vectorized. A column is copied while no sample is appended: the receiver thread of the sampler agent appends
+    concurrently, and an array('d') cannot grow while a NumPy view of it exists.
+    """
+
+    def __init__(self, columns: Iterable[str], capacity: int = None):
+        self.columns = list(columns)
+        self.capacity = capacity
+        self._column_index = {column: index for index, column in enumerate(self.columns)}
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self.total_count = 0
+            if self.capacity:
+                self._time = array('d', bytes(8 * self.capacity))
+                self._data = [array('d', bytes(8 * self.capacity)) for _ in self.columns]
+            else:
+                self._time = array('d')
+                self._data = [array('d') for _ in self.columns]
+
+    def __len__(self) -> int:
+        if self.capacity:
+            return min(self.total_count, self.capacity)
+        return self.total_count
+
+    def append(self, timestamp: float, values: Sequence[float]):
+        """
+        :param timestamp: wall clock time of the sample
+        :param values: one value per column, in the order of self.columns
+        """
+        with self._lock:
+            if self.capacity:
+                position = self.total_count % self.capacity
+                self._time[position] = timestamp
+                for column_data, value in zip(self._data, values):
+                    column_data[position] = value
+            else:
+                self._time.append(timestamp)
+                for column_data, value in zip(self._data, values):
+                    column_data.append(value)
+            self.total_count += 1
+
+    def _chronological(self, column_indexes: Sequence[int]) -> list:
+        """
+        :param column_indexes: indexes of the columns in self.columns, None for the timestamps
+        :return: the columns with the same samples, copied at once so no append lands between two of them
+        """
+        with self._lock:
+            length = len(self)
+            total_count = self.total_count
+            # copies, no view of the buffers outlives the lock
+            data = [np.array(buffer[:length] if not self.capacity else buffer, dtype=np.float64)
+                    for buffer in (self._time if index is None else self._data[index] for index in column_indexes)]
+        if not self.capacity or total_count <= self.capacity:
+            return [column_data[:length] for column_data in data]
+        head = total_count % self.capacity
+        return [np.concatenate((column_data[head:], column_data[:head])) for column_data in data]
+
+    def timestamps(self) -> np.ndarray:
+        return self._chronological([None])[0]
+
+    def column(self, name: str) -> np.ndarray:
+        return self._chronological([self._column_index[name]])[0]
+
+    def matrix(self, names: Sequence[str]) -> np.ndarray:
+        """:return: a (samples, len(names)) float64 array of the columns, e.g. the usage of every CPU core over time"""
+        if not names:
+            return np.zeros((len(self), 0))
+        return np.column_stack(self._chronological([self._column_index[name] for name in names]))
+
+    def mean(self, name: str) -> float:
+        """:return: the mean of a column, 0 without samples"""
+        data = self.column(name)
+        return float(data.mean()) if data.size else 0
+
+    def min(self, name: str) -> float:
+        data = self.column(name)
+        return float(data.min()) if data.size else 0
+
+    def max(self, name: str) -> float:
+        data = self.column(name)
+        return float(data.max()) if data.size else 0
+
+    def percentiles(self, name: str, percentiles: Sequence[float] = (50, 95, 99)) -> list:
+        data = self.column(name)
+        if not data.size:
+            return [0] * len(percentiles)
+        return [float(value) for value in np.percentile(data, percentiles)]
+
+    def summary(self, name: str) -> dict:
+        """:return: {"mean", "min", "max", "p50", "p95", "p99"} of a column"""
+        data = self.column(name)
+        if not data.size:
+            return {"mean": 0, "min": 0, "max": 0, "p50": 0, "p95": 0, "p99": 0}
+        p50, p95, p99 = np.percentile(data, (50, 95, 99))
+        return {"mean": float(data.mean()), "min": float(data.min()), "max": float(data.max()),
+                "p50": float(p50), "p95": float(p95), "p99": float(p99)}
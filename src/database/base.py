@@ -1,13 +1,20 @@
 # coding: utf-8
 # author: Wang Junfeng
 
+import io
 import os
 import json
 import inspect
+import numbers
+from contextlib import contextmanager
 from enum import Enum
+from threading import Lock
+from typing import Iterator
 from sqlalchemy import (create_engine, Column, DateTime, Integer, String, Text, ARRAY, Float,
-                        Boolean, ForeignKey, select, distinct)
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship, Session
+                        Boolean, ForeignKey, JSON, select, distinct, text, table, column)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.orm import (sessionmaker, scoped_session, declarative_base, relationship, Session, selectinload,
+                            contains_eager)
 from sqlalchemy_utils import database_exists, create_database
 from sqlalchemy.sql import func
 from sqlalchemy.schema import UniqueConstraint
@@ -53,6 +60,77 @@ class BaseOperations:
     def _records_to_dict(records):
         return {column.key: getattr(records, column.key) for column in sql_inspect(records).mapper.column_attrs}
 
+    # columns set by the database or SQLAlchemy, add_many never takes them from the rows
+    GENERATED_COLUMNS = ("id", "create_time", "modified_time")
+    # values add_data sets for the columns a row leaves out
+    ROW_DEFAULTS = {}
+    # python types of the column types, checked by prepare_row
+    COLUMN_TYPES = ((Boolean, bool), (Integer, numbers.Integral), (Float, numbers.Real), (String, str), (Text, str))
+
+    @classmethod
+    def unique_constraint(cls):
+        """:return: the uq_* UniqueConstraint of the table, None when it has none"""
+        for constraint in cls.__table__.constraints:
+            if isinstance(constraint, UniqueConstraint) and (constraint.name or "").startswith("uq_"):
+                return constraint
+        return None
+
+    @classmethod
+    def check_value(cls, table_column, value):
+        if value is None:
+            if not table_column.nullable:
+                raise ValueError(f"{cls.__name__} column {table_column.name} is required.")
+            return
+        if isinstance(table_column.type, ARRAY):
+            if not isinstance(value, (list, tuple)):
+                raise ValueError(f"{cls.__name__} column {table_column.name} must be a list, not {value!r}.")
+            return
+        for column_type, python_type in cls.COLUMN_TYPES:
+            if isinstance(table_column.type, column_type) and not isinstance(value, python_type):
+                raise ValueError(f"{cls.__name__} column {table_column.name} must be {python_type.__name__}, "
+                                 f"not {value!r}.")
+
+    @classmethod
+    def prepare_row(cls, data_dict: dict) -> dict:
+        """
+        Validate one row of add_many in Python, before anything is sent to the database.
+
+        Args:
+            data_dict: Dictionary containing fields to add, as for add_data.
+
+        Returns:
+            dict: The value of every column but GENERATED_COLUMNS.
+        """
+        row = {}
+        for table_column in cls.__table__.columns:
+            if table_column.name in cls.GENERATED_COLUMNS:
+                continue
+            if table_column.name in data_dict:
+                value = data_dict[table_column.name]
+            else:
+                value = cls.ROW_DEFAULTS.get(table_column.name)
+            cls.check_value(table_column, value)
+            row[table_column.name] = value
+        return row
+
+    @classmethod
+    def validate_rows(cls, session: Session, rows: list):
+        """Check the prepared rows against the database, e.g. the ids they reference, raise ValueError if not."""
+
+    @classmethod
+    def after_add_many(cls, session: Session, rows: list, ids: list):
+        """Apply the side effects of add_data to the rows added by add_many, in the same transaction."""
+
+    @staticmethod
+    def _check_referenced_ids(session: Session, rows: list, key: str, referenced_class):
+        """Check that the ids of the array column key of every row exist in referenced_class, with one query."""
+        referenced_ids = {referenced_id for row in rows for referenced_id in row[key]}
+        existing_ids = set(session.scalars(select(referenced_class.id).where(
+            referenced_class.id.in_(referenced_ids))).all()) if referenced_ids else set()
+        missing_ids = referenced_ids - existing_ids
+        if missing_ids:
+            raise ValueError(f"{key} {sorted(missing_ids)} not in {referenced_class.__name__}.id")
+
     @classmethod
     def delete_data(cls, session: Session, data_id: int):
         """
@@ -87,16 +165,7 @@ class BaseOperations:
             List: A list of records matching the filter conditions.
         """
         try:
-            query = session.query(cls)  # Start building the query
-            for key, value in data_dict.items():
-                if hasattr(cls, key):  # Dynamically filter based on column names
-                    column = getattr(cls, key)
-                    # 如果列是字符串类型，则使用 LIKE 进行模糊匹配
-                    if isinstance(column.type, String) and isinstance(value, str):
-                        query = query.filter(column.like(f"%{value}%"))
-                    else:
-                        query = query.filter(column == value)
-
+            query = cls.filter_query(session.query(cls), data_dict)  # Start building the query
             results = query.all()  # Fetch all matching records
 
             return [cls._records_to_dict(record) for record in results]
@@ -104,6 +173,30 @@ class BaseOperations:
         except Exception as e:
             cls._handle_exception(session, e, data_dict)
 
+    @classmethod
+    def filter_query(cls, query, data_dict: dict):
+        """
+        Add the filters of query_data to a query or select of the table, or of some of its columns.
+
+        Args:
+            query: The query to filter.
+            data_dict (dict): Dictionary of filter conditions, keys that are not columns of the table are ignored.
+        """
+        for key, value in data_dict.items():
+            if hasattr(cls, key):  # Dynamically filter based on column names
+                column = getattr(cls, key)
+                # 如果列是字符串类型，则使用 LIKE 进行模糊匹配
+                if isinstance(column.type, String) and isinstance(value, str):
+                    query = query.filter(column.like(f"%{value}%"))
+                else:
+                    query = query.filter(column == value)
+        return query
+
+    @staticmethod
+    def _id_array(id_query):
+        """:return: ARRAY(SELECT id ...) of a select of ids, for the array operators <@ and &&"""
+        return func.array(id_query.scalar_subquery(), type_=ARRAY(Integer))
+
 
 class IPCConfig(BaseOperations, Base):
     __tablename__ = "ipc_config"
@@ -231,6 +324,8 @@ class ControllerConfig(BaseOperations, Base):
         "controller_id", "controller_version", "cameras_id", "cameras_type", "image_width", "image_height",
         "image_channel", "capture_images_count", "network_inference_count", name='uq_controller_config'),)
 
+    ROW_DEFAULTS = {"image_channel": 3}
+
     @classmethod
     def add_data(cls, session, data_dict):
         """
@@ -358,6 +453,8 @@ class WorkstationConfig(BaseOperations, Base):
         "workstation_id", "controller_config_id", "to_next_ws_offset", "camera_reset_time",
         "sequence_count", "sequences_id", "sequences_interval", name='uq_workstation_config'),)
 
+    ROW_DEFAULTS = {"camera_reset_time": 0}
+
     @classmethod
     def add_data(cls, session, data_dict):
         """
@@ -431,34 +528,52 @@ class WorkstationConfig(BaseOperations, Base):
             List: A list of records matching the filter conditions.
         """
         try:
-            query = session.query(cls).join(ControllerConfig)  # Start building the query
-            for key, value in data_dict.items():
-                if hasattr(cls, key):  # Dynamically filter based on column names
-                    column = getattr(cls, key)
-                    # 特殊处理 cameras_type 数组
-                    if key == "cameras_type" and isinstance(value, list):
-                        # 使用 PostgreSQL 的 && 操作符检查数组是否有交集
-                        query = query.filter(column.op('&&')(value))
-                    # 如果列是字符串类型，则使用 LIKE 进行模糊匹配
-                    elif isinstance(column.type, String) and isinstance(value, str):
-                        query = query.filter(column.like(f"%{value}%"))
-                    else:
-                        query = query.filter(column == value)
-
-            results = query.all()  # Fetch all matching records
-            return_result = []
-            for workstation in results:
-                result = {
-                    "workstation_config": BaseOperations._records_to_dict(workstation),
-                    "controller_config": BaseOperations._records_to_dict(workstation.controller_config)
-                }
-                return_result.append(result)
-
-            return return_result
+            # the controller of every workstation is loaded by the join
+            query = session.query(cls).join(ControllerConfig).options(contains_eager(cls.controller_config))
+            results = cls.filter_query(query, data_dict).all()  # Fetch all matching records
+            return [cls._workstation_to_dict(workstation) for workstation in results]
 
         except Exception as e:
             cls._handle_exception(session, e, data_dict)
 
+    @classmethod
+    def filter_query(cls, query, data_dict: dict):
+        for key, value in data_dict.items():
+            if hasattr(cls, key):  # Dynamically filter based on column names
+                column = getattr(cls, key)
+                # 特殊处理 cameras_type 数组
+                if key == "cameras_type" and isinstance(value, list):
+                    # 使用 PostgreSQL 的 && 操作符检查数组是否有交集
+                    query = query.filter(column.op('&&')(value))
+                # 如果列是字符串类型，则使用 LIKE 进行模糊匹配
+                elif isinstance(column.type, String) and isinstance(value, str):
+                    query = query.filter(column.like(f"%{value}%"))
+                else:
+                    query = query.filter(column == value)
+        return query
+
+    @staticmethod
+    def _workstation_to_dict(workstation):
+        return {
+            "workstation_config": BaseOperations._records_to_dict(workstation),
+            "controller_config": BaseOperations._records_to_dict(workstation.controller_config)
+        }
+
+    @classmethod
+    def query_by_ids(cls, session: Session, ids):
+        """
+        Query the workstations of many ids with their controllers in one query.
+
+        Returns:
+            dict: {id: {"workstation_config": ..., "controller_config": ...}}, ids that do not exist are left out.
+        """
+        ids = set(ids)
+        if not ids:
+            return {}
+        workstations = (session.query(cls).join(ControllerConfig).options(contains_eager(cls.controller_config))
+                        .filter(cls.id.in_(ids)).all())
+        return {workstation.id: cls._workstation_to_dict(workstation) for workstation in workstations}
+
 
 class CommunicationConfig(BaseOperations, Base):
     __tablename__ = "communication_config"
@@ -493,6 +608,20 @@ class CommunicationConfig(BaseOperations, Base):
         "communication_step", "workstation_count", "workstation_config_ids", "workstations_in_use",
         name='uq_communication_config'),)
 
+    @classmethod
+    def prepare_row(cls, data_dict: dict) -> dict:
+        data_dict = dict(data_dict)
+        if data_dict.get("communication_type") == CommunicationType.MOTION_SHOOTING.value:
+            data_dict["communication_step"] = CommunicationStep.TWO_STEP.value
+        if (data_dict.get("communication_type") == CommunicationType.STATIC_SHOOTING.value
+                and data_dict.get("communication_step") not in CommunicationStep._value2member_map_):
+            raise ValueError(f"communication_step {data_dict.get('communication_step')} value not correct.")
+        return super().prepare_row(data_dict)
+
+    @classmethod
+    def validate_rows(cls, session: Session, rows: list):
+        cls._check_referenced_ids(session, rows, "workstation_config_ids", WorkstationConfig)
+
     @classmethod
     def add_data(cls, session, data_dict):
         """
@@ -590,53 +719,57 @@ class CommunicationConfig(BaseOperations, Base):
             List[CommunicationConfig]: A list of CommunicationConfig objects matching the filter conditions.
         """
         try:
-            # Step 1: Separate filters for CommunicationConfig and WorkstationConfig
-            filter_communication = {}
-            filter_workstation = {}
-
-            for key, value in data_dict.items():
-                if hasattr(CommunicationConfig, key):
-                    filter_communication[key] = value
-                elif hasattr(WorkstationConfig, key) or hasattr(ControllerConfig, key):
-                    filter_workstation[key] = value
-
-            # Step 2: Query CommunicationConfig based on filter_communication
-            query = session.query(CommunicationConfig)
-            for key, value in filter_communication.items():
-                column = getattr(CommunicationConfig, key)
-                query = query.filter(column == value)
-
-            queried_communication_configs = query.all()
-
-            # Step 3: Query WorkstationConfig based on filter_workstation
-            query = session.query(WorkstationConfig).join(ControllerConfig)
-            for key, value in filter_workstation.items():
-                if hasattr(WorkstationConfig, key):
-                    column = getattr(WorkstationConfig, key)
-                else:
-                    column = getattr(ControllerConfig, key)
-                query = query.filter(column == value)
-
-            queried_workstation_configs = WorkstationConfig.query_data(session, filter_workstation)
-            queried_workstation_config_ids = {ws["workstation_config"]["id"] for ws in queried_workstation_configs}
-
-            # Step 4: Filter CommunicationConfig based on WorkstationConfig
-            filtered_communication_configs = []
-            for comm_config in queried_communication_configs:
-                if set(comm_config.workstation_config_ids).issubset(queried_workstation_config_ids):
-                    result = {"communication_config": (BaseOperations._records_to_dict(comm_config)),
-                              "workstation_configs": []}
-                    for workstation_config_id in comm_config.workstation_config_ids:
-                        result["workstation_configs"].extend(
-                            WorkstationConfig.query_data(session, {"id": workstation_config_id})
-                        )
-                    filtered_communication_configs.append(result)
-
-            return filtered_communication_configs
+            queried_communication_configs = cls.filter_query(session.query(cls), data_dict).all()
+            return cls._communication_configs_to_dicts(session, queried_communication_configs)
 
         except Exception as e:
             logger.error(f"{cls.__name__} {inspect.currentframe().f_code.co_name} Failed to query: {e}")
 
+    @classmethod
+    def filter_query(cls, query, data_dict: dict):
+        """
+        Add the filters of query_data to a query or select of the table, in SQL.
+        Keys of WorkstationConfig select the configs whose workstations all match them:
+        workstation_config_ids <@ ARRAY(SELECT id of the matching workstations).
+        """
+        filter_workstation = {}
+        for key, value in data_dict.items():
+            if hasattr(CommunicationConfig, key):
+                query = query.filter(getattr(CommunicationConfig, key) == value)
+            elif hasattr(WorkstationConfig, key) or hasattr(ControllerConfig, key):
+                filter_workstation[key] = value
+
+        workstation_config_ids = WorkstationConfig.filter_query(
+            select(WorkstationConfig.id).join(ControllerConfig), filter_workstation)
+        return query.filter(cls.workstation_config_ids.op('<@')(cls._id_array(workstation_config_ids)))
+
+    @classmethod
+    def _communication_configs_to_dicts(cls, session: Session, communication_configs):
+        # the workstations of all the configs in one query
+        workstation_configs = WorkstationConfig.query_by_ids(session, {
+            workstation_config_id for comm_config in communication_configs
+            for workstation_config_id in comm_config.workstation_config_ids})
+        return [{"communication_config": (BaseOperations._records_to_dict(comm_config)),
+                 "workstation_configs": [workstation_configs[workstation_config_id]
+                                         for workstation_config_id in comm_config.workstation_config_ids
+                                         if workstation_config_id in workstation_configs]}
+                for comm_config in communication_configs]
+
+    @classmethod
+    def query_by_ids(cls, session: Session, ids):
+        """
+        Query the communication configs of many ids with their workstations in two queries.
+
+        Returns:
+            dict: {id: {"communication_config": ..., "workstation_configs": [...]}}, ids that do not exist are left out.
+        """
+        ids = set(ids)
+        if not ids:
+            return {}
+        communication_configs = session.query(cls).filter(cls.id.in_(ids)).all()
+        return {result["communication_config"]["id"]: result
+                for result in cls._communication_configs_to_dicts(session, communication_configs)}
+
 
 class IPCPerformance(BaseOperations, Base):
     __tablename__ = "ipc_performance"
@@ -655,9 +788,20 @@ class IPCPerformance(BaseOperations, Base):
     gpus_usage_avg = Column(ARRAY(Float), nullable=False)  # Array of Float
     gpus_memory_usage_avg = Column(ARRAY(Float), nullable=False)  # Array of Float
     memory_usage_avg = Column(Float, nullable=False)
-    disk_usage_avg = Column(Float, nullable=False)
+    disk_usage_avg = Column(Float, nullable=False)  # 图片输出路径 (PROD_OUTPUT) 所在磁盘的使用率
     disk_read_speed_avg = Column(Float, nullable=False)
     disk_write_speed_avg = Column(Float, nullable=False)
+    # 每块磁盘的IO，与disk_devices一一对应，await单位为ms
+    disk_devices = Column(ARRAY(String), nullable=True)  # Array of strings
+    disk_read_iops_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    disk_write_iops_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    disk_busy_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    disk_await_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    # 每块网卡的吞吐 (MB/s) 和丢包数，与network_interfaces一一对应
+    network_interfaces = Column(ARRAY(String), nullable=True)  # Array of strings
+    network_rx_speed_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    network_tx_speed_avg = Column(ARRAY(Float), nullable=True)  # Array of Float
+    network_drops = Column(ARRAY(Integer), nullable=True)  # Array of Integer
     create_time = Column(DateTime, default=func.now())  # Automatically set on insert
     modified_time = Column(DateTime, default=func.now(), onupdate=func.now())  # Set and update on modification
 
@@ -670,6 +814,25 @@ class IPCPerformance(BaseOperations, Base):
         "gpus_usage_avg", "gpus_memory_usage_avg", "memory_usage_avg", "disk_usage_avg", "disk_read_speed_avg",
         "disk_write_speed_avg", name='uq_ipc_performance'),)
 
+    @classmethod
+    def after_add_many(cls, session: Session, rows: list, ids: list):
+        """Append the new ids to the ipc_performance_ids of their SimulationResult, once each, as add_data does."""
+        new_ids = {}
+        for row, row_id in zip(rows, ids):
+            if row_id is not None and row["simulation_result_id"] is not None:
+                new_ids.setdefault(row["simulation_result_id"], {})[row_id] = None
+        if not new_ids:
+            return
+        # one UPDATE per SimulationResult, the ids it already has are left out in the order of rows
+        session.execute(text(
+            "UPDATE simulation_result SET modified_time = now(), ipc_performance_ids = array_cat("
+            "COALESCE(ipc_performance_ids, '{}'), ARRAY(SELECT new_id FROM unnest(CAST(:ids AS integer[])) "
+            "WITH ORDINALITY AS new_ids(new_id, position) "
+            "WHERE new_id <> ALL(COALESCE(ipc_performance_ids, '{}')) ORDER BY position)) "
+            "WHERE id = :simulation_result_id"),
+            [{"simulation_result_id": simulation_result_id, "ids": list(ids_of_result)}
+             for simulation_result_id, ids_of_result in new_ids.items()])
+
     @classmethod
     def add_data(cls, session, data_dict):
         """
@@ -696,6 +859,15 @@ class IPCPerformance(BaseOperations, Base):
                 disk_usage_avg=data_dict["disk_usage_avg"],
                 disk_read_speed_avg=data_dict["disk_read_speed_avg"],
                 disk_write_speed_avg=data_dict["disk_write_speed_avg"],
+                disk_devices=data_dict.get("disk_devices"),
+                disk_read_iops_avg=data_dict.get("disk_read_iops_avg"),
+                disk_write_iops_avg=data_dict.get("disk_write_iops_avg"),
+                disk_busy_avg=data_dict.get("disk_busy_avg"),
+                disk_await_avg=data_dict.get("disk_await_avg"),
+                network_interfaces=data_dict.get("network_interfaces"),
+                network_rx_speed_avg=data_dict.get("network_rx_speed_avg"),
+                network_tx_speed_avg=data_dict.get("network_tx_speed_avg"),
+                network_drops=data_dict.get("network_drops"),
             )
             session.add(new_ipc_performance)
 
@@ -862,6 +1034,30 @@ class SimulationResult(BaseOperations, Base):
     min_25d_height_time = Column(Float, nullable=True)
     avg_25d_height_time = Column(Float, nullable=True)
 
+    # 耗时的分位数，max只反映单个异常值，avg会掩盖尾部延迟
+    p50_part_use_time = Column(Float, nullable=True)
+    p95_part_use_time = Column(Float, nullable=True)
+    p99_part_use_time = Column(Float, nullable=True)
+    p50_image_capture_time = Column(Float, nullable=True)
+    p95_image_capture_time = Column(Float, nullable=True)
+    p99_image_capture_time = Column(Float, nullable=True)
+    p50_cortex_infer_time = Column(Float, nullable=True)
+    p95_cortex_infer_time = Column(Float, nullable=True)
+    p99_cortex_infer_time = Column(Float, nullable=True)
+    p50_25d_mean_time = Column(Float, nullable=True)
+    p95_25d_mean_time = Column(Float, nullable=True)
+    p99_25d_mean_time = Column(Float, nullable=True)
+    p50_25d_normal_time = Column(Float, nullable=True)
+    p95_25d_normal_time = Column(Float, nullable=True)
+    p99_25d_normal_time = Column(Float, nullable=True)
+    p50_25d_height_time = Column(Float, nullable=True)
+    p95_25d_height_time = Column(Float, nullable=True)
+    p99_25d_height_time = Column(Float, nullable=True)
+    # 各耗时的DDSketch (DDSketch.to_dict())，包含直方图，多次运行或多台IPC的结果可以直接合并
+    latency_sketches = Column(JSON, nullable=True)
+    # 本次运行的采样数据和日志事件的列式归档 (RunArchive) 目录
+    run_archive_path = Column(String, nullable=True)
+
     # IPC性能和资源消耗
     ipc_performance_ids = Column(ARRAY(Integer), nullable=False)  # Array of Integer
     # IPC 的核心分配
@@ -873,6 +1069,21 @@ class SimulationResult(BaseOperations, Base):
     # Define relationship to IPCPerformance
     ipc_performance = relationship('IPCPerformance', back_populates='simulation_result', cascade="all, delete-orphan")
 
+    @classmethod
+    def prepare_row(cls, data_dict: dict) -> dict:
+        data_dict = dict(data_dict)
+        if data_dict.setdefault("detection_dimension", 0) not in DetectionDimension._value2member_map_:
+            raise ValueError(f"detection_dimension {data_dict['detection_dimension']} not correct.")
+        if data_dict["detection_dimension"] == DetectionDimension.TWO_D.value:
+            for stage in ("mean", "normal", "height"):
+                for statistic in ("max", "min", "avg"):
+                    data_dict.setdefault(f"{statistic}_25d_{stage}_time", 0)
+        return super().prepare_row(data_dict)
+
+    @classmethod
+    def validate_rows(cls, session: Session, rows: list):
+        cls._check_referenced_ids(session, rows, "communication_config_ids", CommunicationConfig)
+
     @classmethod
     def add_data(cls, session, data_dict):
         """
@@ -943,6 +1154,28 @@ class SimulationResult(BaseOperations, Base):
                     min_25d_height_time=data_dict["min_25d_height_time"],
                     avg_25d_height_time=data_dict["avg_25d_height_time"],
 
+                    # latency percentiles
+                    p50_part_use_time=data_dict.get("p50_part_use_time"),
+                    p95_part_use_time=data_dict.get("p95_part_use_time"),
+                    p99_part_use_time=data_dict.get("p99_part_use_time"),
+                    p50_image_capture_time=data_dict.get("p50_image_capture_time"),
+                    p95_image_capture_time=data_dict.get("p95_image_capture_time"),
+                    p99_image_capture_time=data_dict.get("p99_image_capture_time"),
+                    p50_cortex_infer_time=data_dict.get("p50_cortex_infer_time"),
+                    p95_cortex_infer_time=data_dict.get("p95_cortex_infer_time"),
+                    p99_cortex_infer_time=data_dict.get("p99_cortex_infer_time"),
+                    p50_25d_mean_time=data_dict.get("p50_25d_mean_time"),
+                    p95_25d_mean_time=data_dict.get("p95_25d_mean_time"),
+                    p99_25d_mean_time=data_dict.get("p99_25d_mean_time"),
+                    p50_25d_normal_time=data_dict.get("p50_25d_normal_time"),
+                    p95_25d_normal_time=data_dict.get("p95_25d_normal_time"),
+                    p99_25d_normal_time=data_dict.get("p99_25d_normal_time"),
+                    p50_25d_height_time=data_dict.get("p50_25d_height_time"),
+                    p95_25d_height_time=data_dict.get("p95_25d_height_time"),
+                    p99_25d_height_time=data_dict.get("p99_25d_height_time"),
+                    latency_sketches=data_dict.get("latency_sketches"),
+                    run_archive_path=data_dict.get("run_archive_path"),
+
                     ipc_performance_ids=data_dict["ipc_performance_ids"],
                     core_allocation=data_dict["core_allocation"],
                 )
@@ -1020,53 +1253,42 @@ class SimulationResult(BaseOperations, Base):
                     filter_ipc_config[key] = value
 
             # Step 2: Query SimulationResult based on filter_simulation
-            query = session.query(cls).join(IPCPerformance).join(IPCConfig)  # Start building the query
-            for key, value in filter_simulation.items():
-                if hasattr(cls, key):  # Dynamically filter based on column names
-                    column = getattr(cls, key)
-                    # 如果列是字符串类型，则使用 LIKE 进行模糊匹配
-                    if isinstance(column.type, String) and isinstance(value, str):
-                        query = query.filter(column.like(f"%{value}%"))
-                    else:
-                        query = query.filter(column == value)
+            # the performances and their IPC configs are loaded by two more queries for all the results
+            query = session.query(cls).join(IPCPerformance).join(IPCConfig).options(
+                selectinload(cls.ipc_performance).joinedload(IPCPerformance.ipc_config))
+            query = cls.filter_query(query, filter_simulation)
+
+            # Step 3: at least one of the IPC configs matches filter_ipc_config
+            ipc_config_ids = IPCConfig.filter_query(select(IPCConfig.id), filter_ipc_config)
+            query = query.filter(cls.ipcs_config_id.op('&&')(cls._id_array(ipc_config_ids)))
+
+            # Step 4: all the communication configs match filter_communication
+            communication_config_ids = CommunicationConfig.filter_query(select(CommunicationConfig.id),
+                                                                        filter_communication)
+            query = query.filter(cls.communication_config_ids.op('<@')(cls._id_array(communication_config_ids)))
 
             queried_simulation_results = query.all() # Fetch all matching records
-            filtered_queried_simulation_results = []
-            for simulation_result in queried_simulation_results:
-                query_ipc_config_data = []
-                for ipc_config_id in simulation_result.ipcs_config_id:
-                    query_ipc_config_data_dict = {"id": ipc_config_id}
-                    query_ipc_config_data_dict.update(filter_ipc_config)
-                    query_data = IPCConfig.query_data(session, data_dict=query_ipc_config_data_dict)
-                    query_ipc_config_data.extend(query_data)
-                if query_ipc_config_data:
-                    filtered_queried_simulation_results.append(simulation_result)
-            queried_simulation_results = filtered_queried_simulation_results
-
-            # Step 3: Query CommunicationConfig based on filter_communication
-            queried_communication_configs = CommunicationConfig.query_data(session, filter_communication)
-            queried_communication_config_ids = {ws["communication_config"]["id"] for ws in queried_communication_configs}
-
-
-            # Step 4: Filter SimulationResult based on                 elif hasattr(WorkstationConfig, key) or hasattr(ControllerConfig, key) or hasattr(CommunicationConfig, key):
+            queried_communication_configs = CommunicationConfig.query_by_ids(session, {
+                com_id for simulation_result in queried_simulation_results
+                for com_id in simulation_result.communication_config_ids})
+
             filtered_simulation_results = []
             for simulation_result in queried_simulation_results:
-                if set(simulation_result.communication_config_ids).issubset(queried_communication_config_ids):
-                    result = {
-                        "simulation_result": (BaseOperations._records_to_dict(simulation_result)),
-                        "ipc_performances": [],
-                        "communication_configs": [],
-                    }
-                    for perf in simulation_result.ipc_performance:
-                        result["ipc_performances"].append(
-                            {
-                                "ipc_performance": BaseOperations._records_to_dict(perf),
-                                "ipc_config": BaseOperations._records_to_dict(perf.ipc_config)
-                             }
-                        )
-                    for com_id in simulation_result.communication_config_ids:
-                        result["communication_configs"].extend(CommunicationConfig.query_data(session, {"id": com_id}))
-                    filtered_simulation_results.append(result)
+                result = {
+                    "simulation_result": (BaseOperations._records_to_dict(simulation_result)),
+                    "ipc_performances": [],
+                    "communication_configs": [],
+                }
+                for perf in simulation_result.ipc_performance:
+                    result["ipc_performances"].append(
+                        {
+                            "ipc_performance": BaseOperations._records_to_dict(perf),
+                            "ipc_config": BaseOperations._records_to_dict(perf.ipc_config)
+                         }
+                    )
+                for com_id in simulation_result.communication_config_ids:
+                    result["communication_configs"].append(queried_communication_configs[com_id])
+                filtered_simulation_results.append(result)
             return filtered_simulation_results
 
         except Exception as e:
@@ -1093,32 +1315,179 @@ class TableFactory:
 
 
 class ConfigurableSimulationSystemDB:
+    """
+    Handle on the simulation database.
+
+    The engine and its connection pool are shared by the whole process and created once by init(), together
+    with the database and the tables when they do not exist yet. The pool is configured by the POOL_* keys of
+    settings.json, connections are checked with a ping before they are used.
+
+    Every operation runs in its own short-lived session, see session_scope, so a failed operation never leaves
+    its state behind for the next one and handles can be used from several threads. Reads use sessions that do
+    not expire their objects on commit. request_scope lets all the operations of one request, e.g. one call of
+    an API server, share a single session of the current thread.
+    """
     json_file = os.path.abspath(os.path.join(project_root_path, "config/settings.json"))
     with open(json_file, "r") as f:
         database_settings = json.load(f)
     database_url = (f"postgresql://{database_settings['USERNAME']}:{database_settings['PASSWORD']}"
                     f"@{database_settings['LOCAL_HOST']}/{database_settings['DATABASE_NAME']}")
 
+    # add_many loads at least this many rows through COPY instead of multi-row INSERT statements
+    COPY_THRESHOLD = 5000
+    # bind parameters of one multi-row INSERT, PostgreSQL accepts 65535 at most
+    MAX_INSERT_PARAMETERS = 32767
+    ON_CONFLICT_ACTIONS = ("skip", "update")
+
+    engine = None
+    session_maker = None
+    read_session_maker = None
+    # session of the request_scope of every thread
+    scoped_sessions = None
+    _init_lock = Lock()
+
     def __init__(self):
-        self.engine = self.init_database()
-        self.init_table()
-        self.session_maker = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-        self.session = self.session_maker()
+        if ConfigurableSimulationSystemDB.engine is None:
+            self.init()
+        self._session = None
 
-    def init_database(self):
-        if not database_exists(self.database_url):
-            create_database(self.database_url)
-        return create_engine(self.database_url)
+    @classmethod
+    def init(cls):
+        """Create the process wide engine, the database and the tables, only the first call does anything."""
+        with cls._init_lock:
+            if ConfigurableSimulationSystemDB.engine is not None:
+                return
+            engine = cls.init_database()
+            cls.init_table(engine)
+            ConfigurableSimulationSystemDB.session_maker = sessionmaker(autocommit=False, autoflush=False,
+                                                                        bind=engine)
+            # read results are used after their session is closed, they must not be expired by a commit
+            ConfigurableSimulationSystemDB.read_session_maker = sessionmaker(autocommit=False, autoflush=False,
+                                                                             expire_on_commit=False, bind=engine)
+            ConfigurableSimulationSystemDB.scoped_sessions = scoped_session(
+                ConfigurableSimulationSystemDB.session_maker)
+            # set last, handles are only created once everything is ready
+            ConfigurableSimulationSystemDB.engine = engine
+            logger.info(f"{cls.__name__} initialized the engine of {cls.database_settings['DATABASE_NAME']}.")
 
-    def init_table(self):
-        Base.metadata.create_all(bind=self.engine)
+    @classmethod
+    def dispose(cls):
+        """Close every pooled connection, e.g. after a fork, the next handle initializes the engine again."""
+        with cls._init_lock:
+            if ConfigurableSimulationSystemDB.scoped_sessions is not None:
+                ConfigurableSimulationSystemDB.scoped_sessions.remove()
+            if ConfigurableSimulationSystemDB.engine is not None:
+                ConfigurableSimulationSystemDB.engine.dispose()
+            ConfigurableSimulationSystemDB.engine = None
+            ConfigurableSimulationSystemDB.session_maker = None
+            ConfigurableSimulationSystemDB.read_session_maker = None
+            ConfigurableSimulationSystemDB.scoped_sessions = None
 
-    def get_db(self):
-        db = self.session_maker()
+    @classmethod
+    def init_database(cls):
+        if not database_exists(cls.database_url):
+            create_database(cls.database_url)
+        settings = cls.database_settings
+        return create_engine(cls.database_url,
+                             echo=settings.get("ECHO_LOG", False),
+                             pool_size=settings.get("POOL_SIZE", 5),
+                             max_overflow=settings.get("MAX_OVERFLOW", 10),
+                             pool_timeout=settings.get("POOL_TIMEOUT", 30),
+                             pool_recycle=settings.get("POOL_RECYCLE", 1800),
+                             pool_pre_ping=settings.get("POOL_PRE_PING", True))
+
+    @classmethod
+    def init_table(cls, engine):
+        Base.metadata.create_all(bind=engine)
+        cls.add_missing_columns(engine)
+
+    @staticmethod
+    def add_missing_columns(engine):
+        """
+        Add the nullable columns of the models that an existing table does not have yet, create_all only creates
+        the missing tables. ADD COLUMN IF NOT EXISTS keeps it idempotent when several processes start at once.
+        """
+        inspector = sql_inspect(engine)
+        with engine.begin() as connection:
+            for table_name, model_table in Base.metadata.tables.items():
+                existing_columns = {table_column["name"] for table_column in inspector.get_columns(table_name)}
+                for table_column in model_table.columns:
+                    if table_column.name in existing_columns:
+                        continue
+                    if not table_column.nullable:
+                        logger.error(f"Column {table_name}.{table_column.name} is missing and cannot be added to "
+                                     f"the existing rows without a value.")
+                        continue
+                    column_type = table_column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table_name} "
+                                            f"ADD COLUMN IF NOT EXISTS {table_column.name} {column_type}"))
+                    logger.info(f"Column {table_name}.{table_column.name} {column_type} added.")
+
+    @property
+    def session(self) -> Session:
+        """Long-lived session of this handle, only kept for existing callers, operations use session_scope."""
+        if self._session is None:
+            self._session = self.session_maker()
+        return self._session
+
+    @classmethod
+    @contextmanager
+    def request_scope(cls) -> Iterator[Session]:
+        """
+        Share one session between all the operations of the current thread until the scope exits.
+        The session is rolled back when the request fails and closed at the end, nested scopes reuse it.
+        """
+        if ConfigurableSimulationSystemDB.engine is None:
+            cls.init()
+        scoped_sessions = ConfigurableSimulationSystemDB.scoped_sessions
+        if scoped_sessions.registry.has():
+            yield scoped_sessions()
+            return
+        session = scoped_sessions()
         try:
-            yield db
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            scoped_sessions.remove()
+
+    @contextmanager
+    def session_scope(self, read_only: bool = False) -> Iterator[Session]:
+        """
+        Session of one operation: the session of the request_scope of the current thread if there is one,
+        otherwise a new session that is rolled back on an error and closed at the end.
+        :param read_only: the objects of the session are not expired by a commit
+        """
+        scoped_sessions = ConfigurableSimulationSystemDB.scoped_sessions
+        if scoped_sessions is not None and scoped_sessions.registry.has():
+            session = scoped_sessions()
+            try:
+                yield session
+            except Exception:
+                # the following operations of the request still get a usable session
+                session.rollback()
+                raise
+            return
+        session = (self.read_session_maker if read_only else self.session_maker)()
+        try:
+            yield session
+        except Exception:
+            session.rollback()
+            raise
         finally:
-            db.close()
+            session.close()
+
+    def close(self):
+        """Return the connection of the long-lived session to the pool."""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def get_db(self):
+        with self.session_scope() as db:
+            yield db
 
     def add_data(self, table_name, data_dict):
         try:
@@ -1126,13 +1495,13 @@ class ConfigurableSimulationSystemDB:
             if not table_class:
                 raise Exception(f"Table {table_name} does not exist!")
 
-            new_data_id = table_class.add_data(session=self.session, data_dict=data_dict)
+            with self.session_scope() as session:
+                new_data_id = table_class.add_data(session=session, data_dict=data_dict)
             return new_data_id
 
         except KeyError as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
         except IntegrityError:
-            self.session.rollback()
             logger.warning(f"Duplicate entry detected table {table_name} {data_dict}.")
         except Exception as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
@@ -1143,12 +1512,12 @@ class ConfigurableSimulationSystemDB:
             if not table_class:
                 raise Exception(f"Table {table_name} does not exist!")
 
-            table_class.update_data(session=self.session, data_dict=data_dict)
+            with self.session_scope() as session:
+                table_class.update_data(session=session, data_dict=data_dict)
 
         except KeyError as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
         except IntegrityError:
-            self.session.rollback()
             logger.warning(f"Duplicate entry detected table {table_name} {data_dict}.")
         except Exception as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
@@ -1159,7 +1528,8 @@ class ConfigurableSimulationSystemDB:
             if not table_class:
                 raise Exception(f"Table {table_name} does not exist!")
 
-            query_data = table_class.query_data(session=self.session, data_dict=data_dict)
+            with self.session_scope(read_only=True) as session:
+                query_data = table_class.query_data(session=session, data_dict=data_dict)
             return query_data
 
         except KeyError as e:
@@ -1175,61 +1545,231 @@ class ConfigurableSimulationSystemDB:
             if not table_class:
                 raise Exception(f"Table {table_name} does not exist!")
 
-            table_class.delete_data(session=self.session, data_id=data_id)
+            with self.session_scope() as session:
+                table_class.delete_data(session=session, data_id=data_id)
 
         except KeyError as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
         except IntegrityError:
-            self.session.rollback()
             logger.warning(f"Duplicate entry detected table {table_name} {data_id}.")
         except Exception as e:
             logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
 
+    def add_many(self, table_name, rows, on_conflict=None, use_copy=None):
+        """
+        Add many rows to a table in one transaction, either all of them are added or none.
+
+        Every row is validated in Python first, see BaseOperations.prepare_row, then the rows are inserted with
+        multi-row INSERT statements, or loaded through COPY into a staging table and inserted from there.
+        :param rows: [data_dict, ...], as for add_data
+        :param on_conflict: what to do with a row that violates the uq_* constraint of the table,
+                            None: add nothing and log the IntegrityError, also when two of the rows are equal
+                                  under it, the rows are not deduplicated,
+                            "skip": keep the existing row, the id of the row is None,
+                            "update": overwrite the existing row, the id of the row is the id of the existing row
+        :param use_copy: load the rows through COPY, by default for COPY_THRESHOLD rows or more
+        :return: the id of every row in the order of rows, equal rows get the same id, None if nothing was added
+        """
+        try:
+            table_class = TableFactory.get_table(table_name)
+            if on_conflict is not None and on_conflict not in self.ON_CONFLICT_ACTIONS:
+                raise ValueError(f"on_conflict {on_conflict} not in {self.ON_CONFLICT_ACTIONS}.")
+            if on_conflict is not None and table_class.unique_constraint() is None:
+                raise ValueError(f"Table {table_name} has no unique constraint to resolve conflicts on.")
+
+            prepared_rows = [table_class.prepare_row(row) for row in rows]
+            if not prepared_rows:
+                return []
+            if use_copy is None:
+                use_copy = len(prepared_rows) >= self.COPY_THRESHOLD
+
+            with self.session_scope() as session:
+                table_class.validate_rows(session, prepared_rows)
+                if use_copy and session.get_bind().dialect.driver != "psycopg2":
+                    logger.warning(f"{self.__class__.__name__} the database driver has no COPY, rows are inserted.")
+                    use_copy = False
+                insert_rows = self._copy_rows if use_copy else self._insert_rows
+                ids = insert_rows(session, table_class, prepared_rows, on_conflict)
+                table_class.after_add_many(session, prepared_rows, ids)
+                session.commit()
+            logger.info(f"{table_class.__name__} added {sum(row_id is not None for row_id in ids)} "
+                        f"of {len(ids)} rows.")
+            return ids
+
+        except KeyError as e:
+            logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
+        except IntegrityError as e:
+            logger.warning(f"Duplicate entry detected table {table_name}, no row added: {e.orig}")
+        except Exception as e:
+            logger.error(f"{inspect.currentframe().f_code.co_name} failed {e}")
+
+    @staticmethod
+    def _row_key(row, columns) -> tuple:
+        """:return: the values of columns, arrays as tuples so the key can be hashed"""
+        return tuple(tuple(row[name]) if isinstance(row[name], list) else row[name] for name in columns)
+
+    @classmethod
+    def _unique_rows(cls, table_class, rows: list, on_conflict) -> (list, list):
+        """
+        :return: the rows without the ones equal to an earlier row under the unique constraint, the last one of
+                 them wins for "update", and the unique constraint columns
+        """
+        if on_conflict is None:
+            return rows, []
+        key_columns = [table_column.name for table_column in table_class.unique_constraint().columns]
+        unique_rows = {}
+        for row in rows:
+            key = cls._row_key(row, key_columns)
+            if on_conflict == "update" or key not in unique_rows:
+                unique_rows[key] = row
+        return list(unique_rows.values()), key_columns
+
+    @staticmethod
+    def _on_conflict(statement, table_class, on_conflict, columns):
+        constraint_name = table_class.unique_constraint().name
+        if on_conflict == "skip":
+            return statement.on_conflict_do_nothing(constraint=constraint_name)
+        key_columns = {table_column.name for table_column in table_class.unique_constraint().columns}
+        updated_columns = {name: statement.excluded[name] for name in columns if name not in key_columns}
+        # the existing row is always updated, so RETURNING also returns its id
+        updated_columns["modified_time"] = func.now()
+        return statement.on_conflict_do_update(constraint=constraint_name, set_=updated_columns)
+
+    def _returned_ids(self, result, rows: list, key_columns: list) -> list:
+        """:return: the id of every row, found by its unique constraint columns in the RETURNING rows"""
+        ids = {self._row_key(returned._mapping, key_columns): returned.id for returned in result}
+        return [ids.get(self._row_key(row, key_columns)) for row in rows]
+
+    def _insert_rows(self, session: Session, table_class, rows: list, on_conflict) -> list:
+        table_columns = table_class.__table__.c
+        unique_rows, key_columns = self._unique_rows(table_class, rows, on_conflict)
+        statement = postgresql_insert(table_class.__table__)
+        if on_conflict is None:
+            statement = statement.returning(table_columns.id, sort_by_parameter_order=True)
+        else:
+            statement = self._on_conflict(statement, table_class, on_conflict, list(rows[0])).returning(
+                table_columns.id, *[table_columns[name] for name in key_columns])
+        # executed as one INSERT with many VALUES per page of rows
+        page_size = max(self.MAX_INSERT_PARAMETERS // len(rows[0]), 1)
+        result = session.execute(statement.execution_options(insertmanyvalues_page_size=page_size), unique_rows)
+        if on_conflict is None:
+            return list(result.scalars())
+        return self._returned_ids(result, rows, key_columns)
+
+    @staticmethod
+    def _copy_text(value) -> str:
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, numbers.Integral):
+            return str(int(value))
+        if isinstance(value, numbers.Real):
+            return repr(float(value))
+        return str(value)
+
+    @classmethod
+    def _copy_value(cls, table_column, value) -> str:
+        """:return: value as a field of COPY ... (FORMAT csv, NULL '\\N')"""
+        if value is None:
+            return "\\N"
+        if isinstance(table_column.type, JSON):
+            value = json.dumps(value)
+        elif isinstance(table_column.type, ARRAY):
+            # array literal, every element quoted
+            value = "{" + ",".join(
+                "NULL" if element is None else
+                '"' + cls._copy_text(element).replace("\\", "\\\\").replace('"', '\\"') + '"'
+                for element in value) + "}"
+        else:
+            value = cls._copy_text(value)
+        return '"' + value.replace('"', '""') + '"'
+
+    def _copy_rows(self, session: Session, table_class, rows: list, on_conflict) -> list:
+        """Load the rows into a staging table through COPY, then insert them in one INSERT ... SELECT."""
+        table_name = table_class.__tablename__
+        table_columns = table_class.__table__.c
+        columns = list(rows[0])
+        unique_rows, key_columns = self._unique_rows(table_class, rows, on_conflict)
+        staging_name = f"{table_name}_staging"
+        column_list = ", ".join(columns)
+        # no constraint of the table is copied, they are checked by the INSERT
+        session.execute(text(f"CREATE TEMPORARY TABLE {staging_name} ON COMMIT DROP AS "
+                             f"SELECT {column_list}, 0 AS row_index, id FROM {table_name} WITH NO DATA"))
+        buffer = io.StringIO()
+        for row_index, row in enumerate(unique_rows):
+            buffer.write(",".join([self._copy_value(table_columns[name], row[name]) for name in columns]
+                                  + [str(row_index)]) + "\n")
+        buffer.seek(0)
+        with session.connection().connection.dbapi_connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {staging_name} ({column_list}, row_index) FROM STDIN "
+                               f"WITH (FORMAT csv, NULL '\\N')", buffer)
+
+        staging = table(staging_name, *[column(name) for name in columns], column("row_index"), column("id"))
+        if on_conflict is None:
+            # the ids are drawn from the sequence of the table into the staging table first, so the id of every
+            # row is known by its row_index whatever order the INSERT ... SELECT takes
+            session.execute(text(f"UPDATE {staging_name} "
+                                 f"SET id = nextval(pg_get_serial_sequence(:table_name, 'id'))"),
+                            {"table_name": table_name})
+            session.execute(postgresql_insert(table_class.__table__).from_select(
+                ["id"] + columns, select(staging.c.id, *[staging.c[name] for name in columns])))
+            ids = list(session.execute(select(staging.c.id).order_by(staging.c.row_index)).scalars())
+        else:
+            # the rows come back in any order, their ids are found by the unique constraint columns
+            statement = postgresql_insert(table_class.__table__).from_select(
+                columns, select(*[staging.c[name] for name in columns]).order_by(staging.c.row_index))
+            statement = self._on_conflict(statement, table_class, on_conflict, columns)
+            result = session.execute(statement.returning(table_columns.id,
+                                                         *[table_columns[name] for name in key_columns]))
+            ids = self._returned_ids(result, rows, key_columns)
+        session.execute(text(f"DROP TABLE {staging_name}"))
+        return ids
+
     def get_all_controller_ids(self):
         """
         return the controller_config table id and the controller id
         :return: [(controller_config_id, controller_id),]
         """
-        results = self.session.query(ControllerConfig.id, ControllerConfig.controller_id).all()
+        with self.session_scope(read_only=True) as session:
+            results = session.query(ControllerConfig.id, ControllerConfig.controller_id).all()
         return [(result.id, result.controller_id) for result in results]
 
     def get_used_controller_ids(self):
-        controller_ids = self.session.query(WorkstationConfig.controller_config_id).distinct().all()
+        with self.session_scope(read_only=True) as session:
+            controller_ids = session.query(WorkstationConfig.controller_config_id).distinct().all()
         return [cid[0] for cid in controller_ids]  # 转换成 ID 列表
 
     def is_controller_used(self, controller_id: int):
-        return self.session.query(WorkstationConfig).filter_by(controller_config_id=controller_id).first() is not None
+        with self.session_scope(read_only=True) as session:
+            return session.query(WorkstationConfig).filter_by(controller_config_id=controller_id).first() is not None
 
     def get_controller_usage(self):
         # 列表 [(controller_id, workstation_id), ...]
-        results = self.session.query(
-            ControllerConfig.id, WorkstationConfig.id
-        ).join(WorkstationConfig, ControllerConfig.id == WorkstationConfig.controller_config_id).all()
+        with self.session_scope(read_only=True) as session:
+            results = session.query(
+                ControllerConfig.id, WorkstationConfig.id
+            ).join(WorkstationConfig, ControllerConfig.id == WorkstationConfig.controller_config_id).all()
 
         return results
 
     def get_used_cpu(self):
         # 查询去重后的CPU和GPU配置
-        results = self.session.query(distinct(IPCConfig.cpu)).join(
-            IPCPerformance, IPCPerformance.ipc_config_id == IPCConfig.id
-        ).join(
-            SimulationResult, SimulationResult.ipc_performance_ids.any(IPCPerformance.id)
-        ).all()
+        with self.session_scope(read_only=True) as session:
+            results = session.query(distinct(IPCConfig.cpu)).join(
+                IPCPerformance, IPCPerformance.ipc_config_id == IPCConfig.id
+            ).join(
+                SimulationResult, SimulationResult.ipc_performance_ids.any(IPCPerformance.id)
+            ).all()
 
         return [cpu for (cpu,) in results]
 
     def get_used_gpus(self):
         # 查询去重的gpus信息
-        result = self.session.query(distinct(IPCConfig.gpus)).join(
-            IPCPerformance, IPCPerformance.ipc_config_id == IPCConfig.id
-        ).join(
-            SimulationResult, SimulationResult.ipc_performance_ids.any(IPCPerformance.id)
-        ).all()
+        with self.session_scope(read_only=True) as session:
+            result = session.query(distinct(IPCConfig.gpus)).join(
+                IPCPerformance, IPCPerformance.ipc_config_id == IPCConfig.id
+            ).join(
+                SimulationResult, SimulationResult.ipc_performance_ids.any(IPCPerformance.id)
+            ).all()
 
         # 返回结果中的GPU列表
         return [gpus for (gpus,) in result]
-
-
-
-
-
@@ -1,8 +1,11 @@
 # coding: utf-8
 # author: Wang Junfeng
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from src.database.base import SimulationResult, ConfigurableSimulationSystemDB
+from sqlalchemy import event
+
+from src.database.base import SimulationResult, IPCConfig, ConfigurableSimulationSystemDB
 
 
 def ipc_config_add_data_test():
@@ -467,7 +470,121 @@ def used_cpu_gpus_test():
     print(f"used_cpus: {used_gpus}")
 
 
+def shared_engine_test():
+    first_database = ConfigurableSimulationSystemDB()
+    second_database = ConfigurableSimulationSystemDB()
+    assert first_database.engine is second_database.engine
+    assert first_database.session is not second_database.session
+    start_time = time.time()
+    for _ in range(1000):
+        ConfigurableSimulationSystemDB().close()
+    print(f"1000 handles created in {time.time() - start_time:.4f}s")
+
+
+def session_scope_test():
+    database_test = ConfigurableSimulationSystemDB()
+
+    def query_ipc_configs(index):
+        with database_test.session_scope(read_only=True) as session:
+            return index, session.query(IPCConfig).count()
+
+    # every thread gets its own session, none of them share an identity map
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for index, count in executor.map(query_ipc_configs, range(32)):
+            print(f"{index}: {count} ipc configs")
+
+    # a failed operation does not leave its session unusable for the next one
+    database_test.add_data("ipc_config", {"name": None})
+    print(database_test.get_all_controller_ids())
+
+    with ConfigurableSimulationSystemDB.request_scope() as request_session:
+        with database_test.session_scope() as session:
+            assert session is request_session
+        print(database_test.get_used_controller_ids())
+
+
+def add_many_test(row_count=10000):
+    database_test = ConfigurableSimulationSystemDB()
+    rows = [{
+        "name": f"bulk_{index}",
+        "cpu": "13-i8",
+        "gpus": ["4080", "4080"],
+        "ram": "test_ram",
+        "ssds": ["test_ssd1", "test_ssd2"],
+        "software_version": "4.7",
+    } for index in range(row_count)]
+
+    start_time = time.time()
+    ids = database_test.add_many(table_name="ipc_config", rows=rows[:1000], on_conflict="skip", use_copy=False)
+    print(f"1000 rows inserted in {time.time() - start_time:.4f}s, {ids.count(None)} duplicates")
+
+    start_time = time.time()
+    ids = database_test.add_many(table_name="ipc_config", rows=rows, on_conflict="skip", use_copy=True)
+    print(f"{row_count} rows copied in {time.time() - start_time:.4f}s, {ids.count(None)} duplicates")
+
+    # the existing rows are returned by update
+    ids = database_test.add_many(table_name="ipc_config", rows=rows[:10], on_conflict="update")
+    assert None not in ids
+    print(ids)
+
+    # a conflict without on_conflict adds none of the rows
+    assert database_test.add_many(table_name="ipc_config", rows=rows[:10]) is None
+
+    # the ids of copied rows are in the order of rows
+    new_rows = [dict(row, name=f"{row['name']}_{time.time()}") for row in rows[:100]]
+    ids = database_test.add_many(table_name="ipc_config", rows=new_rows, use_copy=True)
+    with database_test.session_scope(read_only=True) as session:
+        names = [session.get(IPCConfig, row_id).name for row_id in ids]
+    assert names == [row["name"] for row in new_rows]
+
+
+def ipc_performance_add_many_test(simulation_result_id=1, row_count=3):
+    database_test = ConfigurableSimulationSystemDB()
+    rows = [{
+        "ipc_config_id": 1,
+        "simulation_result_id": simulation_result_id,
+        "model_size": "5MP",
+        "network_architecture": f"bulk_{time.time()}_{index}",
+        "cpu_usage_avg": 20.2283806343907,
+        "gpus_usage_avg": [25.7846410684474],
+        "gpus_memory_usage_avg": [19.4115372089236],
+        "memory_usage_avg": 12.4136894824707,
+        "disk_usage_avg": 28.0843071786311,
+        "disk_read_speed_avg": 0.000312082075415486,
+        "disk_write_speed_avg": 145.954015496326,
+    } for index in range(row_count)]
+
+    for use_copy in (False, True):
+        ids = database_test.add_many(table_name="ipc_performance", rows=rows, on_conflict="skip", use_copy=use_copy)
+        with database_test.session_scope(read_only=True) as session:
+            ipc_performance_ids = session.get(SimulationResult, simulation_result_id).ipc_performance_ids
+        # the new rows are linked to their simulation result in order, each once
+        new_ids = [row_id for row_id in ids if row_id is not None]
+        assert ipc_performance_ids[len(ipc_performance_ids) - len(new_ids):] == new_ids
+        assert len(set(ipc_performance_ids)) == len(ipc_performance_ids)
+        print(use_copy, ids, ipc_performance_ids)
+        rows = [dict(row, network_architecture=row["network_architecture"] + "_copy") for row in rows]
+
+
+def simulation_result_query_count_test():
+    database_test = ConfigurableSimulationSystemDB()
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database_test.engine, "before_cursor_execute", count_statement)
+    start_time = time.time()
+    simulation_results = database_test.query_data(table_name="simulation_result", data_dict={})
+    event.remove(database_test.engine, "before_cursor_execute", count_statement)
+    # the number of queries does not depend on the number of results
+    print(f"{len(simulation_results)} simulation results queried with {len(statements)} queries "
+          f"in {time.time() - start_time:.4f}s")
+
+
 if __name__ == "__main__":
+    ConfigurableSimulationSystemDB.init()
+
     # new_ipc_config_id = ipc_config_add_data_test()
     # print(f"new_ipc_config_id: {new_ipc_config_id}")
     # new_ipc_config_id = 14
@@ -512,8 +629,18 @@ if __name__ == "__main__":
 
     # simulation_result_query_test()
 
+    # simulation_result_query_count_test()
+
     # used_controller_id_test()
 
     # used_cpu_gpus_test()
 
+    # shared_engine_test()
+
+    # session_scope_test()
+
+    # add_many_test()
+
+    # ipc_performance_add_many_test()
+
     print(f"Done")
\ No newline at end of file
@@ -0,0 +1,127 @@
+# coding: utf-8
+import os
+import tempfile
+
+from src.data.log_reader import iter_logs_between_start_end, find_window_offset
+from src.data.log_analyzer import create_default_analyzer, LogFollower, PartTimelineMetric, analyze_metric
+from src.data.quantile_sketch import DDSketch, merge_sketch_dicts
+
+TEST_LOG_LINES = [
+    "2024-05-01 10:00:00 | INFO | before the benchmark",
+    "2024-05-01 10:00:02.100 | INFO | Starting part group with parts {'group_id': 'g1'}",
+    "2024-05-01 10:00:02.300 | INFO | cortex batch inference on 8 images took 35",
+    "[prod]2024-05-01 10:00:02.500 | INFO | generate_overlaid_image_25d took 0.25 seconds capture_config: MEAN",
+    "2024-05-01 10:00:03.600 | INFO | Marking part group as done {'group_id': 'g1'}",
+    "Traceback (most recent call last):",
+    "2024-05-01 10:00:04 | INFO | Starting part group with parts {'group_id': 'g2'}",
+    "2024-05-01 10:00:05.000 | INFO | cortex batch inference on 8 images took 45",
+    "2024-05-01 10:00:06 | INFO | Marking part group as done {'group_id': 'g2'}",
+    "2024-05-01 10:00:09 | INFO | after the benchmark",
+]
+
+
+def write_test_log() -> str:
+    fd, log_file = tempfile.mkstemp(suffix=".log")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(TEST_LOG_LINES) + "\n")
+    return log_file
+
+
+def logs_between_start_end_test():
+    log_file = write_test_log()
+    try:
+        # no line is logged at exactly 10:00:01, the window opens at the next one
+        lines = list(iter_logs_between_start_end(log_file, "2024-05-01 10:00:01", "2024-05-01 10:00:06"))
+        assert lines == TEST_LOG_LINES[1:9], lines
+
+        start_offset = find_window_offset(log_file, "2024-05-01 10:00:01")
+        indexed_lines = list(iter_logs_between_start_end(log_file, "2024-05-01 10:00:01", "2024-05-01 10:00:06",
+                                                         start_offset=start_offset))
+        assert indexed_lines == lines, indexed_lines
+    finally:
+        os.remove(log_file)
+        if os.path.exists(f"{log_file}.idx"):
+            os.remove(f"{log_file}.idx")
+
+
+def default_analyzer_test():
+    log_file = write_test_log()
+    try:
+        analyzer = create_default_analyzer()
+        results = analyzer.analyze(iter_logs_between_start_end(log_file, "2024-05-01 10:00:01", "2024-05-01 10:00:06"))
+        assert [round(value, 3) for value in results["part_time"]] == [2.0, 1.5, 1.75], results
+        assert results["cortex_infer_time"] == [45, 35, 40], results
+        assert results["generate_25d_time"]["mean"] == [0.25, 0.25, 0.25], results
+        assert results["image_capture_time"] == [0, 0, 0], results
+        assert analyzer.throughput["lines"] == 8, analyzer.throughput
+
+        part_timeline = results["part_timeline"]
+        assert part_timeline["parts"] == 2 and part_timeline["incomplete_parts"] == 0, part_timeline
+        # the inference and 2.5D lines of the test log carry no group id, done is no bottleneck
+        assert part_timeline["unattributed_events"]["cortex_infer"] == 2, part_timeline
+        assert part_timeline["bottleneck"] is None, part_timeline
+    finally:
+        os.remove(log_file)
+
+
+def log_follower_test():
+    log_file = write_test_log()
+    try:
+        follower = LogFollower(log_file, "2024-05-01 10:00:01", poll_interval=0.05)
+        follower.poll()
+        assert follower.results()["cortex_infer_time"] == [45, 35, 40], follower.results()
+
+        # rotate the log, the follower switches to the new file
+        os.rename(log_file, f"{log_file}.1")
+        with open(log_file, "w") as f:
+            f.write("2024-05-01 10:00:07 | INFO | cortex batch inference on 8 images took 55\n")
+            f.write("2024-05-01 10:00:08 | INFO | cortex batch inference on 8 images took 99\n")
+            # continuation of the line after the window
+            f.write("    cortex batch inference on 8 images took 77\n")
+        results = follower.stop("2024-05-01 10:00:07")
+        assert results["cortex_infer_time"] == [55, 35, 45], results
+        # the per part timeline is followed too
+        assert results["part_timeline"]["parts"] == 2, results
+    finally:
+        for path in (log_file, f"{log_file}.1", f"{log_file}.idx"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def part_timeline_test():
+    metric = PartTimelineMetric()
+    analyze_metric(metric, [
+        "2024-05-01 10:00:00.0 | INFO | Starting part group with parts {'group_id': 'g1'}",
+        "2024-05-01 10:00:00.5 | INFO | capture_image took 0.2 seconds group_id: g1",
+        "2024-05-01 10:00:00.7 | INFO | capture_image took 0.2 seconds group_id: g1",
+        "2024-05-01 10:00:01.7 | INFO | cortex batch inference on 8 images group_id: g1 took 40",
+        "2024-05-01 10:00:02.0 | INFO | Marking part group as done {'group_id': 'g1'}",
+        "2024-05-01 10:00:02.0 | INFO | Starting part group with parts {'group_id': 'g2'}",
+    ])
+    result = metric.result()
+    assert result["incomplete_group_ids"] == ["g2"], result
+    assert [round(value, 3) for value in result["stages"]["capture"]["duration"]] == [0.2, 0.2, 0.2], result
+    assert [round(value, 3) for value in result["stages"]["cortex_infer"]["gap"]] == [1.0, 1.0, 1.0], result
+    assert result["bottleneck"] == "cortex_infer", result
+
+
+def quantile_sketch_test():
+    first_run = DDSketch()
+    second_run = DDSketch()
+    for value in range(1, 1001):
+        (first_run if value % 2 else second_run).add(value / 1000)
+    merged = merge_sketch_dicts([first_run.to_dict(), second_run.to_dict()])
+    assert merged.count == 1000, merged.count
+    for value, expected in zip(merged.percentiles(), (0.5, 0.95, 0.99)):
+        assert abs(value - expected) <= expected * merged.relative_accuracy + 0.001, merged.percentiles()
+    assert sum(count for _, _, count in merged.histogram()) == 1000
+
+
+if __name__ == "__main__":
+    logs_between_start_end_test()
+    default_analyzer_test()
+    log_follower_test()
+    part_timeline_test()
+    quantile_sketch_test()
+
+    print(f"Done")
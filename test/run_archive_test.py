@@ -0,0 +1,65 @@
+# coding: utf-8
+import math
+import shutil
+import tempfile
+from threading import Thread
+
+from src.data.time_series import TimeSeriesStore
+from src.data.run_archive import RunArchive
+from src.data.log_analyzer import PartTimelineMetric, analyze_metric
+
+
+def run_archive_test():
+    system_data = TimeSeriesStore(["cpu_usage", "gpu_usage"])
+    for second in range(10):
+        system_data.append(1714557600.0 + second, [second * 10, 50])
+    metric = PartTimelineMetric()
+    analyze_metric(metric, [
+        "2024-05-01 10:00:00.0 | INFO | Starting part group with parts {'group_id': 'g1'}",
+        "2024-05-01 10:00:02.0 | INFO | Marking part group as done {'group_id': 'g1'}",
+        "2024-05-01 10:00:02.0 | INFO | Starting part group with parts {'group_id': 'g2'}",
+    ])
+
+    for compressed in (True, False):
+        path = tempfile.mkdtemp()
+        try:
+            RunArchive.write(path, system_data, {metric.name: metric.events()}, {"edge_name": "edge"},
+                             compressed=compressed)
+            archive = RunArchive(path)
+            assert archive.metadata == {"edge_name": "edge"}, archive.metadata
+            assert archive.samples("cpu_usage").tolist() == [second * 10 for second in range(10)]
+            assert archive.samples("timestamp")[0] == 1714557600.0
+            assert archive.events("part_timeline", "group_id").tolist() == ["g1", "g2"]
+            done_time = archive.events("part_timeline", "done_last_time")
+            assert done_time[0] - archive.events("part_timeline", "start_first_time")[0] == 2.0
+            assert math.isnan(done_time[1])
+            archive.close()
+        finally:
+            shutil.rmtree(path)
+
+
+def time_series_concurrent_append_test():
+    # the receiver thread of the sampler agent appends while the report reads the columns
+    system_data = TimeSeriesStore(["cpu_usage", "memory_usage"])
+    sample_count = 200000
+
+    def append_samples():
+        for sample in range(sample_count):
+            system_data.append(float(sample), [sample % 100, 50.0])
+
+    thread = Thread(target=append_samples)
+    thread.start()
+    while thread.is_alive():
+        timestamps = system_data.timestamps()
+        assert len(system_data.column("cpu_usage")) >= len(timestamps)
+        # the columns of a matrix are taken at the same sample
+        system_data.matrix(["cpu_usage", "memory_usage"])
+    thread.join()
+    assert len(system_data.timestamps()) == sample_count
+
+
+if __name__ == "__main__":
+    run_archive_test()
+    time_series_concurrent_append_test()
+
+    print(f"Done")